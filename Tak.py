@@ -1,4 +1,13 @@
+import logging
 from enum import Enum
+from time import perf_counter
+
+from TakRoads import RoadTracker
+from TakZobrist import getKeys, hashBoard
+from TakStats import STATS, APPLY, ROADS
+
+logger = logging.getLogger(__name__)
+
 
 class COLORS(Enum):
     '''Colors of the two players in Tak
@@ -76,7 +85,14 @@ def getDirectionMods(direction):
 
     return filMod, rowMod
 
+
+def startingReserves(size):
+    """Returns (flats, caps) each player starts with on a board of size
+    """
+    return [10,15,21,30,40,50][size-3], [0,0,1,1,2,2][size-3]
+
 class Player(object):
+    __slots__ = ('name', 'color', 'flats', 'flatsPlayed', 'caps', 'capsPlayed')
 
     def __init__(self, color, name):
         self.name           = name
@@ -94,43 +110,92 @@ class Player(object):
 
 
 class Stone(object):
+    """Immutable, getStone hands out one shared instance per color and piece
+    """
+    __slots__ = ('color', 'piece')
 
     def __init__(self, color, piece):
-        self.color = color
-        self.piece = piece
+        object.__setattr__(self, 'color', color)
+        object.__setattr__(self, 'piece', piece)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Stones are immutable")
+
+    def __reduce__(self):
+        return (getStone, (self.color, self.piece))
 
     def __str__(self):
         return "{} {}".format(self.color.name, self.piece.name)
 
+
+_STONES = {(color, piece): Stone(color, piece) for color in COLORS for piece in PIECES}
+
+def getStone(color, piece):
+    """Returns the shared Stone of a color and piece
+    """
+    return _STONES[(color, piece)]
+
+
 class Space(object):
+    """Immutable square, getSpace and getSpaces hand out shared instances
+    """
+    __slots__ = ('row', 'fil')
 
     # Rows are numbered, files (fil) are lettered
     def __init__(self, row, fil):
-        self.row = row
-        self.fil = fil
+        object.__setattr__(self, 'row', row)
+        object.__setattr__(self, 'fil', fil)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Spaces are immutable")
+
+    def __reduce__(self):
+        return (getSpace, (self.row, self.fil))
 
     def __str__(self):
         return "({}, {})".format(self.row, self.fil)
 
     def ptn(self):
         fils = ["a", "b", "c", "d", "e", "f", "g", "h", "i"]
-        return "{}{}".format(fils[self.fil], self.row)
+        return "{}{}".format(fils[self.fil], self.row+1)
+
+
+# Every square of the largest ptn board, a1 to i9
+_SPACES = [[Space(row, fil) for fil in range(9)] for row in range(9)]
+_BOARD_SPACES = {}
+
+def getSpace(row, fil):
+    """Returns the shared Space of a square, a new one for squares outside of
+    every board
+    """
+    if 0 <= row < 9 and 0 <= fil < 9:
+        return _SPACES[row][fil]
+    return Space(row, fil)
+
+
+def getSpaces(size):
+    """Returns the shared Spaces of a board size, indexed by row * size + fil
+    """
+    if size not in _BOARD_SPACES:
+        _BOARD_SPACES[size] = tuple(getSpace(row, fil) for row in range(size) for fil in range(size))
+    return _BOARD_SPACES[size]
 
 
 class Turn(object):
+    __slots__ = ('color', 'space', 'isMove', 'direction', 'drops', 'piece', 'picks')
 
-    def __init__(self, color, space, isMove=False, direction=0, drops=[], piece=PIECES.flat):
+    def __init__(self, color, space, isMove=False, direction=0, drops=(), piece=PIECES.flat):
         self.color = color
         self.space = space
 
         self.isMove = isMove # Boolean
         self.direction = direction
-        self.drops = drops
+        self.drops = tuple(drops)
 
         self.piece = piece
 
         # Number of stones lifted from starting space
-        self.picks = sum(drops)
+        self.picks = sum(self.drops)
 
     def __str__(self):
 
@@ -149,18 +214,21 @@ class Turn(object):
         direction = ""
         drops = ""
 
-        if not isMove:
+        if not self.isMove:
             if self.piece == PIECES.cap:
-                self.piece = "C"
+                piece = "C"
             elif self.piece == PIECES.wall:
-                self.piece = "S"
+                piece = "S"
         else:
-            picks = self.picks
+            # Stone counts are left out when they are implied
+            if self.picks > 1:
+                picks = self.picks
             direction = directionToSymbol(self.direction)
-            drops = ''.join(drops)
+            if len(self.drops) > 1:
+                drops = ''.join(str(drop) for drop in self.drops)
 
 
-        return "{}".format(
+        return "{}{}{}{}{}".format(
             picks,
             piece,
             space,
@@ -168,41 +236,97 @@ class Turn(object):
             drops
         )
 
+# Stone color of a stack bit
+BIT_COLORS = (COLORS.white, COLORS.black)
+
+
 class Stack(object):
+    """Stack of stones packed in an int: bit n of bits is set when the stone at
+    height n is black. Stones below the top are always flats, so only the top
+    piece is kept. Python ints grow as needed, so stacks of any height fit.
 
-    def __init__(self):
-        self.stones = []
-        self.color = None
+    pickBits and placeBits move stones in constant time, pick and place work
+    with lists of Stones and stones builds the list on request.
+    """
+    __slots__ = ('bits', 'count', 'top', 'color')
 
-    def updateColor(self):
-        if len(self.stones) > 0:
-            self.color = self.stones[-1].color
+    def __init__(self):
+        self.bits  = 0
+        self.count = 0
+        self.top   = None    # piece of the top stone
+        self.color = None    # color of the top stone
+
+    @property
+    def stones(self):
+        """Stones from the bottom up, as shared Stones
+        """
+        if not self.count:
+            return []
+        stones = [getStone(BIT_COLORS[self.bits >> n & 1], PIECES.flat) for n in range(self.count-1)]
+        stones.append(getStone(self.color, self.top))
+        return stones
+
+    def pickBits(self, num):
+        """Removes the top num stones, returns (bits, top piece) of them.
+        Picking no stones leaves the stack as it is.
+        """
+        if not num:
+            return 0, None
+
+        keep = self.count - num
+        bits = self.bits >> keep
+        piece = self.top
+
+        self.bits &= (1 << keep) - 1
+        self.count = keep
+        if keep:
+            self.top = PIECES.flat
+            self.color = BIT_COLORS[self.bits >> (keep-1) & 1]
         else:
+            self.top = None
             self.color = None
+        return bits, piece
+
+    def placeBits(self, bits, num, piece):
+        """Adds num stones from the bottom bit up, piece is the new top
+        """
+        self.bits |= bits << self.count
+        self.count += num
+        self.top = piece
+        self.color = BIT_COLORS[bits >> (num-1) & 1]
 
     def pick(self, num):
         if num == None:
             num = 1
 
-        stackheight = len(self.stones)
+        stackheight = self.count
         if num > stackheight:
             num = stackheight
+        if not num:
+            return []
 
-        picked = self.stones[-num:]
-        self.stones = self.stones[:-num]
-
-
-        self.updateColor()
+        bits, piece = self.pickBits(num)
+        picked = [getStone(BIT_COLORS[bits >> n & 1], PIECES.flat) for n in range(num-1)]
+        picked.append(getStone(BIT_COLORS[bits >> (num-1) & 1], piece))
         return picked
 
     def place(self, stones):
         """Pieces should be an array
         """
-        self.stones += stones
-        self.updateColor()
+        bits = 0
+        for n, stone in enumerate(stones):
+            if stone.color == COLORS.black:
+                bits |= 1 << n
+        if stones:
+            self.placeBits(bits, len(stones), stones[-1].piece)
 
     def height(self):
-        return len(self.stones)
+        return self.count
+
+    def setTopPiece(self, piece):
+        """Changes the piece of the top stone, to flatten a wall or raise it back
+        """
+        self.top = piece
 
 
     def __str__(self):
@@ -217,17 +341,111 @@ class Board(object):
         self.size = size
         self.grid = [ [Stack() for y in range(size)] for x in range(size) ]
 
+        # Road components, kept up to date by apply
+        self.roadTracker = RoadTracker(size)
+
+        # Zobrist hash of the position, kept up to date by apply and undo
+        self.hashKeys = getKeys(size)
+        self.hash = 0
+
+        # Top flats per color (indexed by color.value) and empty squares, kept up to date by apply and undo
+        self.topFlats = [0, 0]
+        self.empty = size*size
+
     def getStack(self, space):
         if space.row < 0 or space.row >= self.size or space.fil < 0 or space.fil >= self.size:
             #reached an off board square, move to next direction
             return None
         return self.grid[space.row][space.fil]
 
+    def tops(self):
+        """Returns lists of the top color, top piece and height of every square,
+        indexed by row * size + fil. Empty squares have None color and piece.
+        """
+        colors  = []
+        pieces  = []
+        heights = []
+        for row in self.grid:
+            for stack in row:
+                colors.append(stack.color)
+                pieces.append(stack.top)
+                heights.append(stack.count)
+        return colors, pieces, heights
+
+    def countTop(self, stack, sign):
+        """Adds (sign 1) or removes (sign -1) a square from the top flat and empty counts
+        """
+        if not stack.count:
+            self.empty += sign
+        elif stack.top == PIECES.flat:
+            self.topFlats[stack.color.value] += sign
+
+    def flatCounts(self):
+        """Returns {white:5, black:7}, flats on top of stacks
+        """
+        return {COLORS.white: self.topFlats[0], COLORS.black: self.topFlats[1]}
+
+    def emptyCount(self):
+        return self.empty
+
+    def roads(self):
+        """Returns {white:True, black:False}, see TakWinSolver.checkRoads
+        """
+        start = perf_counter() if STATS.enabled else None
+
+        output = {
+            COLORS.white: self.roadTracker.hasRoad(COLORS.white),
+            COLORS.black: self.roadTracker.hasRoad(COLORS.black),
+        }
+
+        if start is not None:
+            STATS.stop(ROADS, start)
+        return output
+
+    def roadOwner(self, row, fil):
+        """Color that can use this square in a road, None for empty squares and walls
+        """
+        stack = self.grid[row][fil]
+        if stack.top is not None and stack.top != PIECES.wall:
+            return stack.color
+        return None
+
+    def refresh(self):
+        """Rebuilds the road tracker, counts and hash from the grid, for boards
+        filled without apply. The hash is computed with white to move.
+        """
+        self.roadTracker.reset([self.roadOwner(row, fil) for row in range(self.size) for fil in range(self.size)])
+        self.hash = hashBoard(self)
+
+        self.topFlats = [0, 0]
+        self.empty = 0
+        for row in self.grid:
+            for stack in row:
+                self.countTop(stack, 1)
+
     def apply(self, turn):
+        """Applies a turn and returns an undo record for it.
+        Passing the record to undo restores the board to its state before the turn.
+        """
+        start = perf_counter() if STATS.enabled else None
+
         space = self.grid[turn.space.row][turn.space.fil]
+        index = turn.space.row*self.size + turn.space.fil
+        keys = self.hashKeys
+        previousHash = self.hash
+        previousCounts = (self.topFlats[0], self.topFlats[1], self.empty)
+        changes = []
+        flattened = None
+        self.countTop(space, -1)
         if turn.isMove:
-            # move some stones
-            stones = space.pick(turn.picks)
+            # move some stones, as bits of their colors from the bottom up
+            picks = turn.picks
+            if picks > space.count:
+                picks = space.count
+            carried, piece = space.pickBits(picks)
+
+            if picks:
+                self.hash ^= keys.run(index, space.count, carried, picks, piece)
 
             rowMod, filMod = getDirectionMods(turn.direction)
             row = turn.space.row
@@ -238,19 +456,82 @@ class Board(object):
                 fil += filMod
                 dropSpace = self.grid[row][fil]
 
+                dropIndex = row*self.size + fil
+                height = dropSpace.height()
+                self.countTop(dropSpace, -1)
+
                 # handle flattening walls
-                if dropSpace.stones and dropSpace.stones[-1].piece == PIECES.wall:
-                    dropSpace.stones[-1].piece = PIECES.flat
+                if dropSpace.top == PIECES.wall:
+                    color = dropSpace.color
+                    self.hash ^= keys.stone(dropIndex, height-1, color, PIECES.wall) ^ keys.stone(dropIndex, height-1, color, PIECES.flat)
+                    dropSpace.setTopPiece(PIECES.flat)
+                    if flattened is None:
+                        flattened = []
+                    flattened.append(dropSpace)
+
+                dropBits = carried & ((1 << dropNum) - 1)
+                carried >>= dropNum
+                picks -= dropNum
+                dropPiece = piece if picks == 0 else PIECES.flat
+
+                self.hash ^= keys.run(dropIndex, height, dropBits, dropNum, dropPiece)
+                dropSpace.placeBits(dropBits, dropNum, dropPiece)
+                self.countTop(dropSpace, 1)
 
-                dropSpace.place(stones[:dropNum])
-                stones = stones[dropNum:]
+                changes.append((row*self.size + fil, self.roadOwner(row, fil)))
 
         else:
             # Place a stone
-            stone = Stone(turn.color, turn.piece)
-            space.place([stone])
+            self.hash ^= keys.stone(index, space.count, turn.color, turn.piece)
+            space.placeBits(turn.color.value, 1, turn.piece)
 
-        # print(self)
+        self.hash ^= keys.side
+        self.countTop(space, 1)
+
+        changes.append((index, self.roadOwner(turn.space.row, turn.space.fil)))
+        journal = self.roadTracker.update(changes)
+
+        if start is not None:
+            STATS.stop(APPLY, start)
+        return (turn, flattened, journal, previousHash, previousCounts)
+
+    def undo(self, record):
+        """Reverts the turn that returned record from apply.
+        Records have to be undone in the reverse order they were applied.
+        """
+        turn, flattened, journal, previousHash, previousCounts = record
+        space = self.grid[turn.space.row][turn.space.fil]
+
+        if turn.isMove:
+            rowMod, filMod = getDirectionMods(turn.direction)
+            row = turn.space.row + rowMod*len(turn.drops)
+            fil = turn.space.fil + filMod*len(turn.drops)
+
+            # Pick the dropped stones back up, last drop first
+            carried = 0
+            picks = 0
+            piece = None
+            for dropNum in reversed(turn.drops):
+                dropBits, dropPiece = self.grid[row][fil].pickBits(dropNum)
+                if piece is None:
+                    piece = dropPiece
+                carried = carried << dropNum | dropBits
+                picks += dropNum
+                row -= rowMod
+                fil -= filMod
+
+            if flattened:
+                for stack in flattened:
+                    stack.setTopPiece(PIECES.wall)
+
+            space.placeBits(carried, picks, piece)
+
+        else:
+            space.pickBits(1)
+
+        self.roadTracker.revert(journal)
+        self.hash = previousHash
+        self.topFlats[0], self.topFlats[1], self.empty = previousCounts
 
     def checkWinner(self):
         """Returns None for no winner, otherwise winning color
@@ -300,6 +581,128 @@ class Board(object):
 
 
 
+class IllegalMoveError(ValueError):
+    """Raised for a turn the rules don't allow. ply counts from 0 for the
+    first turn of the game.
+    """
+
+    def __init__(self, turn, reason, ply=None):
+        self.turn   = turn
+        self.reason = reason
+        self.ply    = ply
+
+        prefix = "Ply {} ".format(ply+1) if ply is not None else ""
+        super().__init__("{}{}: {}".format(prefix, self.describe(turn), reason))
+
+    @staticmethod
+    def describe(turn):
+        """ptn of turn, or its fields when the square or direction can't be
+        written as ptn
+        """
+        space = turn.space
+        if 0 <= space.row < 9 and 0 <= space.fil < 9 and (not turn.isMove or isinstance(turn.direction, DIRECTIONS) and turn.picks >= 1):
+            return turn.ptn()
+        if turn.isMove:
+            return "move from {} direction {!r} drops {}".format(space, turn.direction, list(turn.drops))
+        return "{} at {}".format(turn.piece.name, space)
+
+
+def validateTurn(board, turn, ply, flats, caps):
+    """Raises IllegalMoveError unless turn can be played on board at ply.
+    flats and caps are the stones turn.color has left to place. Only the
+    squares the turn touches are looked at, no moves are generated.
+    """
+    size = board.size
+    firstTurn = ply < 2
+
+    # First turn of each player places the opponent's stone
+    if firstTurn:
+        color = COLORS.black if ply == 0 else COLORS.white
+    else:
+        color = COLORS.white if ply % 2 == 0 else COLORS.black
+    if turn.color != color:
+        raise IllegalMoveError(turn, "{} stones are played at this ply".format(color.name), ply)
+
+    row = turn.space.row
+    fil = turn.space.fil
+    if row < 0 or row >= size or fil < 0 or fil >= size:
+        raise IllegalMoveError(turn, "square is off the board", ply)
+    stack = board.getStack(turn.space)
+
+    if not turn.isMove:
+        if stack.count:
+            raise IllegalMoveError(turn, "square is not empty", ply)
+        if firstTurn and turn.piece != PIECES.flat:
+            raise IllegalMoveError(turn, "only flats are placed on the first turn", ply)
+        if turn.piece == PIECES.cap:
+            if caps <= 0:
+                raise IllegalMoveError(turn, "no capstones left to place", ply)
+        elif flats <= 0:
+            raise IllegalMoveError(turn, "no flats left to place", ply)
+        return
+
+    if firstTurn:
+        raise IllegalMoveError(turn, "stacks can't be moved on the first turn", ply)
+    if not stack.count:
+        raise IllegalMoveError(turn, "no stack to move", ply)
+    if stack.color != turn.color:
+        raise IllegalMoveError(turn, "stack is controlled by the opponent", ply)
+    if turn.picks < 1:
+        raise IllegalMoveError(turn, "moves no stones", ply)
+    if turn.picks > size:
+        raise IllegalMoveError(turn, "carries {} stones, at most {} can be carried".format(turn.picks, size), ply)
+    if turn.picks > stack.count:
+        raise IllegalMoveError(turn, "carries {} stones from a stack of {}".format(turn.picks, stack.count), ply)
+    if not isinstance(turn.direction, DIRECTIONS):
+        raise IllegalMoveError(turn, "unknown direction {}".format(turn.direction), ply)
+
+    isCap = stack.top == PIECES.cap
+    rowMod, filMod = getDirectionMods(turn.direction)
+    last = len(turn.drops) - 1
+    for number, dropNum in enumerate(turn.drops):
+        if dropNum < 1:
+            raise IllegalMoveError(turn, "every square passed has to get a stone", ply)
+
+        row += rowMod
+        fil += filMod
+        if row < 0 or row >= size or fil < 0 or fil >= size:
+            raise IllegalMoveError(turn, "moves off the board", ply)
+
+        piece = board.getStack(getSpace(row, fil)).top
+        if piece is not None:
+            if piece == PIECES.cap:
+                raise IllegalMoveError(turn, "can't stack onto a capstone", ply)
+            if piece == PIECES.wall and not (isCap and dropNum == 1 and number == last):
+                raise IllegalMoveError(turn, "only a capstone dropped alone as the last stone flattens a wall", ply)
+
+
+def gameResult(board, mover, exhausted):
+    """End of game check right after mover has moved, in constant time on a
+    Tak.Board. exhausted is True when a player has no stones left to place.
+    Returns (state, winner, winCondition) like the Game fields: STATES.playing
+    while the game goes on, STATES.complete with the winner, or STATES.draw.
+    """
+    roads = board.roads()
+    other = COLORS.black if mover == COLORS.white else COLORS.white
+
+    # A move completing roads for both players wins for the mover
+    if roads[mover]:
+        return STATES.complete, mover, WINS.road
+    if roads[other]:
+        return STATES.complete, other, WINS.road
+
+    # Otherwise the game only ends on a full board or an empty reserve
+    if not exhausted and board.emptyCount():
+        return STATES.playing, None, None
+
+    flats = board.flatCounts()
+    if flats[COLORS.white] == flats[COLORS.black]:
+        return STATES.draw, None, None
+    if flats[COLORS.white] > flats[COLORS.black]:
+        return STATES.complete, COLORS.white, WINS.flat
+    return STATES.complete, COLORS.black, WINS.flat
+
+
 class Game(object):
     """Tak Game
     """
@@ -321,8 +724,24 @@ class Game(object):
         self.winCondition       = None # WinCondition
         self.ptn_result         = None
 
+        # Turns are checked against the rules, off for trusted bulk replay
+        self.validateTurns      = True
+
     def addTurn(self, turn):
-        print(turn)
+        logger.debug("Turn %s", turn)
+        self.recordTurn(turn)
+
+    def recordTurn(self, turn):
+        """Adds a turn without reporting it, used by bulk parsing.
+        Raises IllegalMoveError for turns the rules don't allow, see validateTurns.
+        """
+        if self.validateTurns and self.board:
+            ply = len(self.turns)
+            if ply and self.result()[0] != STATES.playing:
+                raise IllegalMoveError(turn, "the game is already over", ply)
+            player = self.players[turn.color]
+            validateTurn(self.board, turn, ply, player.flats, player.caps)
+
         self.turns.append(turn)
         if not turn.isMove:
             if turn.piece == PIECES.cap:
@@ -333,13 +752,27 @@ class Game(object):
         if self.board:
             self.board.apply(turn)
 
+    def result(self):
+        """Result of the position on the board as (state, winner, winCondition),
+        see gameResult. Unlike state, which holds the ptn result, this follows
+        the turns played, so time wins and resignations are not seen.
+        """
+        if not self.turns:
+            return STATES.new, None, None
+        mover = COLORS.white if len(self.turns) % 2 == 1 else COLORS.black
+        exhausted = any(player.flats + player.caps == 0 for player in self.players.values())
+        return gameResult(self.board, mover, exhausted)
+
     def turnColor(self):
+        """Color of the stones the next turn plays: the player to move, except
+        on each player's first turn where the opponent's stone is placed
+        """
         if (len(self.turns)/2) % 1 == 0:
             output = COLORS.white
         else:
             output = COLORS.black
 
-        output = len(self.turns) < 2
+        firstTurn = len(self.turns) < 2
         if firstTurn:
             if output == COLORS.black:
                 output = COLORS.white
@@ -364,6 +797,14 @@ class Game(object):
                 len(self.turns)/2
             )
 
+        elif    self.state == STATES.draw:
+            return "Tak Game - {} (black) vs {} (white) - {} - draw in {} turns".format(
+                self.players[COLORS.black],
+                self.players[COLORS.white],
+                self.date,
+                len(self.turns)/2
+            )
+
         # Default, complete state game
         else:
             return "Tak Game - {} (black) vs {} (white) - {} - {}({}) wins via {} in {} turns".format(
@@ -0,0 +1,310 @@
+import sys
+import mmap
+import struct
+import argparse
+from datetime import date
+
+import Tak
+import TakMoves
+import TakReader
+
+"""
+TakArchive
+
+Compact binary container for many games. Each game keeps the ptn header
+fields (site, date, players, size, result) and its moves as TakMoves codes.
+An offset index at the end of the file lets the reader memory-map the archive
+and decode any single game without touching the others.
+
+Layout, all integers little endian:
+
+    header   magic "TAKA", version u16, reserved u16, game count u32, index offset u64
+    games    size u8, date ordinal u32 (0 if unknown), site, white, black, result
+             as u16 length + utf-8, ply count u32, then one varint per move
+    index    one u64 file offset per game
+"""
+
+MAGIC   = b'TAKA'
+VERSION = 1
+
+HEADER = struct.Struct('<4sHHIQ')
+OFFSET = struct.Struct('<Q')
+GAME   = struct.Struct('<BI')
+TEXT   = struct.Struct('<H')
+PLIES  = struct.Struct('<I')
+
+
+# ====================================================
+#                     Encoding
+# ====================================================
+
+def writeVarint(buffer, value):
+    while value > 0x7f:
+        buffer.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def readVarint(data, offset):
+    """Returns (value, next offset)
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def writeText(buffer, text):
+    encoded = (text or '').encode('utf-8')
+    buffer += TEXT.pack(len(encoded))
+    buffer += encoded
+
+
+def readText(data, offset):
+    """Returns (text or None, next offset)
+    """
+    length, = TEXT.unpack_from(data, offset)
+    offset += TEXT.size
+    text = bytes(data[offset:offset+length]).decode('utf-8')
+    return text or None, offset + length
+
+
+def encodeGame(game):
+    """Returns the archive record for a Tak.Game as bytes
+    """
+    buffer = bytearray()
+    buffer += GAME.pack(game.size or 0, game.date.toordinal() if game.date else 0)
+    writeText(buffer, game.host)
+    writeText(buffer, game.players[Tak.COLORS.white].name)
+    writeText(buffer, game.players[Tak.COLORS.black].name)
+    writeText(buffer, game.ptn_result)
+
+    buffer += PLIES.pack(len(game.turns))
+    for turn in game.turns:
+        writeVarint(buffer, TakMoves.fromTurn(turn))
+
+    return bytes(buffer)
+
+
+# ====================================================
+#                      Writer
+# ====================================================
+
+class ArchiveWriter(object):
+    """Appends games to a new archive file. Use as a context manager, or call
+    close to write the index.
+    """
+
+    def __init__(self, filepath):
+        self.file = open(filepath, 'wb')
+        self.offsets = []
+
+        # Header is rewritten with the real count and index offset on close
+        self.file.write(HEADER.pack(MAGIC, VERSION, 0, 0, 0))
+
+    def add(self, game):
+        self.offsets.append(self.file.tell())
+        self.file.write(encodeGame(game))
+
+    def close(self):
+        if self.file.closed:
+            return
+
+        indexOffset = self.file.tell()
+        for offset in self.offsets:
+            self.file.write(OFFSET.pack(offset))
+
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, 0, len(self.offsets), indexOffset))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def writeArchive(filepath, games):
+    """Writes an iterable of Tak.Game objects to a new archive, returns the count
+    """
+    with ArchiveWriter(filepath) as writer:
+        for game in games:
+            writer.add(game)
+        return len(writer.offsets)
+
+
+def importArchive(target, filepath, workers=None):
+    """Parses every ptn file in target with TakReader.parseGames and writes the
+    games to an archive. Returns (games written, list of (path, error)).
+    """
+    errors = []
+    with ArchiveWriter(filepath) as writer:
+        for path, game, error in TakReader.parseGames(target, workers=workers):
+            if error:
+                errors.append((path, error))
+            else:
+                writer.add(game)
+        return len(writer.offsets), errors
+
+
+# ====================================================
+#                      Reader
+# ====================================================
+
+class ArchiveReader(object):
+    """Memory-mapped archive. Games are only decoded when accessed:
+    reader[n] rebuilds game n, header(n) reads just its header fields.
+    """
+
+    def __init__(self, filepath):
+        self.file = open(filepath, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, reserved, self.count, self.indexOffset = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise ValueError("{} is not a Tak archive".format(filepath))
+        if version != VERSION:
+            raise ValueError("Unsupported Tak archive version {}".format(version))
+
+    def offset(self, number):
+        if number < 0:
+            number += self.count
+        if number < 0 or number >= self.count:
+            raise IndexError("game {} out of range".format(number))
+        return OFFSET.unpack_from(self.data, self.indexOffset + number*OFFSET.size)[0]
+
+    def readHeader(self, offset):
+        data = self.data
+        size, ordinal = GAME.unpack_from(data, offset)
+        offset += GAME.size
+
+        host, offset   = readText(data, offset)
+        white, offset  = readText(data, offset)
+        black, offset  = readText(data, offset)
+        result, offset = readText(data, offset)
+
+        header = {
+            'site'   : host,
+            'date'   : date.fromordinal(ordinal) if ordinal else None,
+            'white'  : white,
+            'black'  : black,
+            'size'   : size or None,
+            'result' : result,
+        }
+        return header, offset
+
+    def header(self, number):
+        """Returns the header fields of a game as a dict, without decoding moves
+        """
+        return self.readHeader(self.offset(number))[0]
+
+    def moves(self, number):
+        """Returns the moves of a game as TakMoves codes
+        """
+        header, offset = self.readHeader(self.offset(number))
+        return self.readMoves(offset)
+
+    def readMoves(self, offset):
+        data = self.data
+        plies, = PLIES.unpack_from(data, offset)
+        offset += PLIES.size
+
+        moves = []
+        for ply in range(plies):
+            move, offset = readVarint(data, offset)
+            moves.append(move)
+        return moves
+
+    def game(self, number):
+        """Rebuilds game number as a Tak.Game
+        """
+        header, offset = self.readHeader(self.offset(number))
+
+        game = Tak.Game()
+        game.validateTurns = False  # checked when the archive was built
+        game.host = header['site']
+        game.date = header['date']
+        game.players[Tak.COLORS.white].name = header['white']
+        game.players[Tak.COLORS.black].name = header['black']
+        if header['size']:
+            TakReader.setHeader(game, 'Size', str(header['size']))
+
+        moves = self.readMoves(offset)
+        if moves:
+            game.state = Tak.STATES.playing
+        for move in moves:
+            game.recordTurn(TakMoves.toTurn(move))
+
+        if header['result']:
+            TakReader.parseResult(game, 'Result', header['result'])
+
+        return game
+
+    def __getitem__(self, number):
+        return self.game(number)
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for number in range(self.count):
+            yield self.game(number)
+
+    def headers(self):
+        for number in range(self.count):
+            yield self.header(number)
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Build or inspect Tak game archives')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help='import ptn files into an archive')
+    build.add_argument('path', help='ptn file, directory of ptn files or glob')
+    build.add_argument('archive', help='archive file to write')
+    build.add_argument('--workers', type=int, default=None)
+
+    info = commands.add_parser('info', help='list the games in an archive')
+    info.add_argument('archive')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        count, errors = importArchive(args.path, args.archive, workers=args.workers)
+        for path, error in errors:
+            print("FAILED {} - {}".format(path, error))
+        print("Wrote {} games to {}, {} failed".format(count, args.archive, len(errors)))
+        return 1 if errors else 0
+
+    with ArchiveReader(args.archive) as reader:
+        for number, header in enumerate(reader.headers()):
+            print("{} - {} vs {} - {}x{} - {} - {}".format(
+                number,
+                header['white'],
+                header['black'],
+                header['size'],
+                header['size'],
+                header['date'],
+                header['result']
+            ))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
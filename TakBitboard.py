@@ -0,0 +1,403 @@
+from time import perf_counter
+
+from Tak import COLORS, PIECES, Board, Stack, getDirectionMods
+from TakZobrist import getKeys
+from TakStats import STATS, APPLY, ROADS
+
+"""
+TakBitboard
+
+Alternative Tak board engine. The position is kept as integer bitboards (one
+bit per square, index = row * size + fil) for the owner and piece type of the
+top stone of every stack, plus one integer per square encoding the colors of
+the whole stack (bit n set means the stone at height n is black).
+
+BitBoard supports the same operations as Tak.Board (apply, getStack, __str__)
+so it can be used as game.board, and TakWinSolver.checkRoads, countFlats and
+getAllMoves run against it directly.
+"""
+
+# ====================================================
+#                  Bitboard Helpers
+# ====================================================
+
+_MASKS = {}
+
+def getMasks(size):
+    """Returns a dict of precomputed masks for a board size:
+    full board, each edge, and the file masks used when shifting left/right.
+    Masks are built once per size and shared.
+    """
+    if size in _MASKS:
+        return _MASKS[size]
+
+    full = (1 << (size*size)) - 1
+
+    bottom = (1 << size) - 1
+    top = bottom << (size*(size-1))
+
+    left = 0
+    for row in range(size):
+        left |= 1 << (row*size)
+    right = left << (size-1)
+
+    masks = {
+        'full'   : full,
+        'bottom' : bottom,
+        'top'    : top,
+        'left'   : left,
+        'right'  : right,
+        'notLeft'  : full & ~left,
+        'notRight' : full & ~right,
+    }
+    _MASKS[size] = masks
+    return masks
+
+
+def popcount(bits):
+    return bin(bits).count('1')
+
+
+def spread(bits, size, masks):
+    """Returns bits grown by one square in each of the four directions
+    """
+    return (bits
+        | (bits << size)
+        | (bits >> size)
+        | ((bits & masks['notRight']) << 1)
+        | ((bits & masks['notLeft']) >> 1)
+    ) & masks['full']
+
+
+def floodFill(seed, bits, size, masks):
+    """Returns every square of bits connected to seed
+    """
+    group = seed & bits
+    while True:
+        grown = spread(group, size, masks) & bits
+        if grown == group:
+            return group
+        group = grown
+
+
+def hasRoad(bits, size):
+    """Checks if the squares in bits connect top to bottom or left to right
+    """
+    masks = getMasks(size)
+
+    # Cheap reject: a road needs a square on every row or on every file
+    if not (bits & masks['bottom'] and bits & masks['top']) and not (bits & masks['left'] and bits & masks['right']):
+        return False
+
+    if floodFill(masks['bottom'], bits, size, masks) & masks['top']:
+        return True
+    if floodFill(masks['left'], bits, size, masks) & masks['right']:
+        return True
+    return False
+
+
+# ====================================================
+#                     BitBoard
+# ====================================================
+
+class BitBoard(object):
+    """Tak Game Board stored as bitboards
+    """
+
+    def __init__(self, size):
+        self.size = size
+
+        # Top stone owner per square
+        self.white = 0
+        self.black = 0
+
+        # Top stone type per square (flat if neither is set)
+        self.walls = 0
+        self.caps  = 0
+
+        # Per square stack encoding, bit n is set if the stone at height n is black
+        self.stacks  = [0] * (size*size)
+        self.heights = [0] * (size*size)
+
+        # Stack objects handed out by getStack, rebuilt when the square changes
+        self.views = [None] * (size*size)
+
+        # Zobrist hash, same keys and values as Tak.Board
+        self.hashKeys = getKeys(size)
+        self.hash = 0
+
+    @classmethod
+    def fromBoard(cls, board):
+        """Builds a BitBoard with the same position as a Tak.Board
+        """
+        output = cls(board.size)
+        for row in range(board.size):
+            for fil in range(board.size):
+                stack = board.grid[row][fil]
+                if not stack.count:
+                    continue
+
+                # Tak.Board stacks are packed the same way
+                index = row*board.size + fil
+                output.stacks[index] = stack.bits
+                output.heights[index] = stack.count
+                output.setTop(index, stack.color, stack.top)
+        output.hash = board.hash
+        return output
+
+    def toBoard(self):
+        """Returns a Tak.Board with the same position
+        """
+        board = Board(self.size)
+        for index, height in enumerate(self.heights):
+            if height:
+                row, fil = divmod(index, self.size)
+                board.grid[row][fil].placeBits(self.stacks[index], height, self.topPiece(index))
+        board.refresh()
+        board.hash = self.hash
+        return board
+
+    def snapshot(self):
+        """Returns the position as a compact tuple for restore
+        """
+        return (self.white, self.black, self.walls, self.caps, tuple(self.stacks), bytes(self.heights), self.hash)
+
+    def restore(self, snapshot):
+        """Sets the position saved by snapshot
+        """
+        self.white, self.black, self.walls, self.caps, stacks, heights, self.hash = snapshot
+        self.stacks  = list(stacks)
+        self.heights = list(heights)
+        self.views   = [None] * (self.size*self.size)
+
+    def setTop(self, index, color, piece):
+        bit = 1 << index
+        clear = ~bit
+
+        self.white &= clear
+        self.black &= clear
+        self.walls &= clear
+        self.caps  &= clear
+
+        if color == COLORS.white:
+            self.white |= bit
+        elif color == COLORS.black:
+            self.black |= bit
+
+        if piece == PIECES.wall:
+            self.walls |= bit
+        elif piece == PIECES.cap:
+            self.caps |= bit
+
+        self.views[index] = None
+
+    def topPiece(self, index):
+        bit = 1 << index
+        if not (self.white | self.black) & bit:
+            return None
+        if self.walls & bit:
+            return PIECES.wall
+        if self.caps & bit:
+            return PIECES.cap
+        return PIECES.flat
+
+    def topColor(self, index):
+        bit = 1 << index
+        if self.white & bit:
+            return COLORS.white
+        if self.black & bit:
+            return COLORS.black
+        return None
+
+    def tops(self):
+        """Returns lists of the top color, top piece and height of every square,
+        like Tak.Board.tops
+        """
+        squares = range(self.size*self.size)
+        return [self.topColor(index) for index in squares], [self.topPiece(index) for index in squares], list(self.heights)
+
+    def getStack(self, space):
+        if space.row < 0 or space.row >= self.size or space.fil < 0 or space.fil >= self.size:
+            #reached an off board square, move to next direction
+            return None
+
+        index = space.row*self.size + space.fil
+        stack = self.views[index]
+        if stack is None:
+            stack = Stack()
+            height = self.heights[index]
+            if height:
+                stack.placeBits(self.stacks[index], height, self.topPiece(index))
+            self.views[index] = stack
+        return stack
+
+    def apply(self, turn):
+        """Applies a turn and returns an undo record for it, like Tak.Board.apply
+        """
+        start = perf_counter() if STATS.enabled else None
+
+        size = self.size
+        index = turn.space.row*size + turn.space.fil
+
+        # Top bitboards and the origin stack are enough to restore every touched square
+        record = (turn, self.white, self.black, self.walls, self.caps, self.stacks[index], self.heights[index], self.hash)
+        keys = self.hashKeys
+        self.hash ^= keys.side
+
+        if not turn.isMove:
+            # Place a stone
+            self.hash ^= keys.stone(index, self.heights[index], turn.color, turn.piece)
+            if turn.color == COLORS.black:
+                self.stacks[index] |= 1 << self.heights[index]
+            self.heights[index] += 1
+            self.setTop(index, turn.color, turn.piece)
+            if start is not None:
+                STATS.stop(APPLY, start)
+            return record
+
+        # move some stones
+        picks = turn.picks
+        height = self.heights[index]
+        if picks > height:
+            picks = height
+
+        piece = self.topPiece(index)
+        remaining = height - picks
+        carried = self.stacks[index] >> remaining
+
+        for n in range(picks):
+            color = COLORS.black if carried >> n & 1 else COLORS.white
+            self.hash ^= keys.stone(index, remaining+n, color, piece if n == picks-1 else PIECES.flat)
+
+        self.stacks[index] &= (1 << remaining) - 1
+        self.heights[index] = remaining
+        if remaining:
+            self.setTop(index, COLORS.black if self.stacks[index] >> (remaining-1) & 1 else COLORS.white, PIECES.flat)
+        else:
+            self.setTop(index, None, None)
+
+        rowMod, filMod = getDirectionMods(turn.direction)
+        row = turn.space.row
+        fil = turn.space.fil
+
+        for dropNum in turn.drops:
+            row += rowMod
+            fil += filMod
+            dropIndex = row*size + fil
+            dropHeight = self.heights[dropIndex]
+
+            # Stones below the top are always flats, which also handles flattening walls
+            if self.walls >> dropIndex & 1:
+                color = self.topColor(dropIndex)
+                self.hash ^= keys.stone(dropIndex, dropHeight-1, color, PIECES.wall) ^ keys.stone(dropIndex, dropHeight-1, color, PIECES.flat)
+
+            dropBits = carried & ((1 << dropNum) - 1)
+            carried >>= dropNum
+            picks -= dropNum
+
+            for n in range(dropNum):
+                color = COLORS.black if dropBits >> n & 1 else COLORS.white
+                self.hash ^= keys.stone(dropIndex, dropHeight+n, color, piece if picks == 0 and n == dropNum-1 else PIECES.flat)
+
+            self.stacks[dropIndex] |= dropBits << dropHeight
+            self.heights[dropIndex] += dropNum
+
+            color = COLORS.black if dropBits >> (dropNum-1) & 1 else COLORS.white
+            self.setTop(dropIndex, color, piece if picks == 0 else PIECES.flat)
+
+        if start is not None:
+            STATS.stop(APPLY, start)
+        return record
+
+    def undo(self, record):
+        """Reverts the turn that returned record from apply
+        """
+        turn, self.white, self.black, self.walls, self.caps, stack, height, self.hash = record
+
+        size = self.size
+        index = turn.space.row*size + turn.space.fil
+        self.stacks[index] = stack
+        self.heights[index] = height
+        self.views[index] = None
+
+        if turn.isMove:
+            rowMod, filMod = getDirectionMods(turn.direction)
+            row = turn.space.row
+            fil = turn.space.fil
+
+            for dropNum in turn.drops:
+                row += rowMod
+                fil += filMod
+                dropIndex = row*size + fil
+
+                self.heights[dropIndex] -= dropNum
+                self.stacks[dropIndex] &= (1 << self.heights[dropIndex]) - 1
+                self.views[dropIndex] = None
+
+    def roadBits(self, color):
+        """Squares that count towards a road for color (flats and caps)
+        """
+        if color == COLORS.white:
+            return self.white & ~self.walls
+        return self.black & ~self.walls
+
+    def roads(self):
+        """Returns {white:True, black:False} like TakWinSolver.checkRoads
+        """
+        start = perf_counter() if STATS.enabled else None
+
+        output = {
+            COLORS.white: hasRoad(self.roadBits(COLORS.white), self.size),
+            COLORS.black: hasRoad(self.roadBits(COLORS.black), self.size),
+        }
+
+        if start is not None:
+            STATS.stop(ROADS, start)
+        return output
+
+    def emptyCount(self):
+        return self.size*self.size - popcount(self.white | self.black)
+
+    def flatCounts(self):
+        """Returns {white:5, black:7} like TakWinSolver.countFlats
+        """
+        flats = ~(self.walls | self.caps)
+        return {
+            COLORS.white: popcount(self.white & flats),
+            COLORS.black: popcount(self.black & flats),
+        }
+
+    def __str__(self):
+        # Same layout as Tak.Board
+        output = ""
+
+        for row in reversed(range(self.size)):
+
+            output += "["
+            for fil in range(self.size):
+                index = row*self.size + fil
+                height = self.heights[index]
+                if height > 0:
+                    bits = self.stacks[index]
+                    for n in range(height):
+                        if n == height-1:
+                            piece = self.topPiece(index)
+                            if piece == PIECES.wall:
+                                output += "S"
+                            elif piece == PIECES.cap:
+                                output += "C"
+
+                        if bits >> n & 1:
+                            output += "b"
+                        else:
+                            output += "w"
+                else:
+                    output += "."
+                output += "|"
+
+            # Remove extra pipe
+            output = output[:-1]
+            output +="]\n"
+
+        return output
+
@@ -0,0 +1,94 @@
+from itertools import combinations
+
+"""
+TakDrops
+
+Precomputed drop sequences for stack moves. A drop sequence is the number of
+stones left on each space a stack moves over, e.g. picking up 4 stones and
+moving 2 spaces can drop (1, 3), (2, 2) or (3, 1).
+
+Sequences only depend on the carry limit (the board size in standard Tak), so
+DropTable builds them all once and move generation becomes a lookup.
+"""
+
+def dropPermutations(stones, spaces):
+    """Given a stack of a set number of stones, with a limited number of spaces
+    available to move, this function returns a list of lists, where each sublist
+    is a potential sequence of number of stones dropped at each space.
+    """
+    if spaces < 1 or stones < spaces:
+        return []
+
+    # Each sequence is a choice of spaces-1 cut points between the stones
+    permutations = []
+    for cuts in combinations(range(1, stones), spaces-1):
+        drops = []
+        previous = 0
+        for cut in cuts:
+            drops.append(cut - previous)
+            previous = cut
+        drops.append(stones - previous)
+        permutations.append(drops)
+
+    return permutations
+
+
+def packDrops(drops):
+    """Packs a drop sequence into an int, 4 bits per drop, first drop lowest
+    """
+    output = 0
+    for n, drop in enumerate(drops):
+        output |= drop << (4*n)
+    return output
+
+
+def unpackDrops(packed):
+    """Inverse of packDrops, returns a tuple
+    """
+    drops = []
+    while packed:
+        drops.append(packed & 0xf)
+        packed >>= 4
+    return tuple(drops)
+
+
+class DropTable(object):
+    """Immutable drop sequences for one carry limit, indexed by (picks, distance).
+
+    sequences[picks][distance] is every way to drop picks stones over distance spaces.
+    flattens[picks][distance] is every sequence that ends with a lone capstone
+    dropped onto a wall, so the final drop is 1.
+    packedSequences and packedFlattens hold the same sequences as packDrops ints.
+    """
+
+    def __init__(self, carryLimit):
+        self.carryLimit = carryLimit
+
+        sequences = [()]
+        flattens  = [()]
+        for picks in range(1, carryLimit+1):
+            sequences.append(tuple(
+                tuple(tuple(drops) for drops in dropPermutations(picks, distance))
+                for distance in range(carryLimit+1)
+            ))
+            flattens.append(tuple(
+                tuple(tuple(drops) + (1,) for drops in dropPermutations(picks-1, distance-1))
+                if distance > 1 else (((1,),) if picks == 1 and distance == 1 else ())
+                for distance in range(carryLimit+1)
+            ))
+
+        self.sequences = tuple(sequences)
+        self.flattens  = tuple(flattens)
+
+        self.packedSequences = tuple(tuple(tuple(packDrops(drops) for drops in bucket) for bucket in row) for row in self.sequences)
+        self.packedFlattens  = tuple(tuple(tuple(packDrops(drops) for drops in bucket) for bucket in row) for row in self.flattens)
+
+
+_TABLES = {}
+
+def getDropTable(carryLimit):
+    """Returns the shared DropTable for a carry limit, built on first use
+    """
+    if carryLimit not in _TABLES:
+        _TABLES[carryLimit] = DropTable(carryLimit)
+    return _TABLES[carryLimit]
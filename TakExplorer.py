@@ -0,0 +1,424 @@
+import sys
+import mmap
+import heapq
+import random
+import shutil
+import struct
+import argparse
+import tempfile
+
+import TakMoves
+import TakReader
+from Tak import COLORS, STATES, WINS
+from TakBitboard import BitBoard
+
+"""
+TakExplorer
+
+Opening and position explorer. Every game of a corpus is replayed and each
+position it passes through is recorded under its Zobrist hash: the number of
+games that reached it, how those games ended (winner and win type, or draw)
+and the moves played from it.
+
+The index is written to one file of fixed size records sorted by position key,
+so the reader memory-maps it and answers a lookup with a binary search,
+without touching the corpus again. The builder keeps a bounded number of
+positions in memory and spills the rest to sorted runs in temporary files,
+which are merged into the index, so corpora of any size can be indexed:
+
+    python TakExplorer.py build games/ games.takx
+    python TakExplorer.py query games.takx "1. a1 e5 2. c3" --size 5
+
+Layout, all integers little endian:
+
+    header     magic "TAKX", version u16, reserved u16, position count u32,
+               game count u32, moves offset u64
+    positions  key u64, games u32, white road / flat / time wins u32,
+               black road / flat / time wins u32, draws u32,
+               first move u32, move count u32, sorted by key
+    moves      move u64 (TakMoves code), count u32, most played first
+"""
+
+MAGIC   = b'TAKX'
+VERSION = 1
+
+HEADER   = struct.Struct('<4sHHIIQ')
+POSITION = struct.Struct('<Q10I')
+MOVE     = struct.Struct('<QI')
+KEY      = struct.Struct('<Q')
+
+# Result counters of a position, in record order
+RESULTS = [(color, win) for color in COLORS for win in WINS]
+DRAWS   = len(RESULTS)
+
+# Positions the builder holds in memory before spilling a run to disk
+SPILL_POSITIONS = 1 << 18
+
+# Empty boards of every size hash to 0, the size is mixed into the key
+_SIZE_KEYS = [random.Random(0x7a6b + 100 + size).getrandbits(64) for size in range(10)]
+
+
+def positionKey(board):
+    """Index key of a Tak.Board or BitBoard position. The board hash includes
+    the side to move, so the board has to have been built through apply (or
+    refreshed with white to move).
+    """
+    return board.hash ^ _SIZE_KEYS[board.size]
+
+
+def gameResult(game):
+    """Counter index of a game's result, None when the game has no result
+    """
+    if game.state == STATES.draw:
+        return DRAWS
+    if game.state == STATES.complete and game.winner is not None and game.winCondition is not None:
+        return RESULTS.index((game.winner, game.winCondition))
+    return None
+
+
+# ====================================================
+#                     Position Stats
+# ====================================================
+
+class PositionStats(object):
+    """Aggregates of one position. moves is a list of (TakMoves code, count),
+    most played first.
+    """
+
+    def __init__(self, key, games=0, results=None, moves=None):
+        self.key     = key
+        self.games   = games
+        self.results = results or [0] * (DRAWS+1)
+        self.moves   = moves or []
+
+    def wins(self, color, win=None):
+        """Games won by color, by any or by one win type
+        """
+        if win is not None:
+            return self.results[RESULTS.index((color, win))]
+        return sum(self.results[RESULTS.index((color, win))] for win in WINS)
+
+    def draws(self):
+        return self.results[DRAWS]
+
+    def decided(self):
+        """Games with a known result
+        """
+        return sum(self.results)
+
+    def winRate(self, color):
+        """Share of the games with a known result won by color, draws count half
+        """
+        decided = self.decided()
+        if not decided:
+            return None
+        return (self.wins(color) + self.draws()/2) / decided
+
+    def turns(self):
+        """Returns the moves as (Tak.Turn, count)
+        """
+        return [(TakMoves.toTurn(move), count) for move, count in self.moves]
+
+    def __str__(self):
+        output = "{} games - white {} - black {} - draws {}".format(
+            self.games,
+            self.wins(COLORS.white),
+            self.wins(COLORS.black),
+            self.draws()
+        )
+        for move, count in self.moves[:10]:
+            output += "\n  {:10} {}".format(TakMoves.toPtn(move), count)
+        return output
+
+
+# ====================================================
+#                      Builder
+# ====================================================
+
+def writeEntry(file, key, counts, moves, first=0):
+    """Writes a position record, counts being games then results
+    """
+    file.write(POSITION.pack(key, *counts, first, len(moves)))
+
+
+def readRun(file):
+    """Yields (key, counts, {move: count}) of a run written by IndexBuilder.spill
+    """
+    file.seek(0)
+    while True:
+        data = file.read(POSITION.size)
+        if not data:
+            return
+        record = POSITION.unpack(data)
+        count = record[-1]
+        yield record[0], list(record[1:-2]), dict(MOVE.iter_unpack(file.read(MOVE.size*count)))
+
+
+class IndexBuilder(object):
+    """Collects position aggregates, write saves them as an index.
+    maxPly limits the positions recorded per game, None records all of them.
+    Once spillPositions positions are held in memory they are written as a
+    sorted run to a temporary file (in tempDir if given), write merges the runs.
+    """
+
+    def __init__(self, maxPly=None, spillPositions=SPILL_POSITIONS, tempDir=None):
+        self.maxPly = maxPly
+        self.spillPositions = spillPositions
+        self.tempDir = tempDir
+        self.games = 0
+
+        # key -> [games, results..., {move: count}]
+        self.positions = {}
+
+        # Temporary files of the spilled runs
+        self.runs = []
+
+    def record(self, key, result, move, seen):
+        entry = self.positions.get(key)
+        if entry is None:
+            entry = self.positions[key] = [0] * (DRAWS+2) + [{}]
+
+        # Repeated positions count once per game, every move played from them counts
+        if key not in seen:
+            seen.add(key)
+            entry[0] += 1
+            if result is not None:
+                entry[1+result] += 1
+
+        if move is not None:
+            moves = entry[-1]
+            moves[move] = moves.get(move, 0) + 1
+
+    def add(self, game):
+        """Replays a Tak.Game and records its positions
+        """
+        if not game.size:
+            return
+
+        self.games += 1
+        result = gameResult(game)
+        seen = set()
+
+        turns = game.turns
+        if self.maxPly is not None:
+            turns = turns[:self.maxPly]
+
+        # Only the hash is needed, the bitboard replays without road tracking
+        board = BitBoard(game.size)
+        for turn in turns:
+            self.record(positionKey(board), result, TakMoves.fromTurn(turn), seen)
+            board.apply(turn)
+
+        if self.maxPly is None or len(game.turns) < self.maxPly:
+            self.record(positionKey(board), result, None, seen)
+
+        # Games are kept whole in memory, their positions count once however they are split
+        if len(self.positions) >= self.spillPositions:
+            self.spill()
+
+    def entries(self):
+        """Yields (key, counts, {move: count}) of the positions in memory, by key
+        """
+        for key in sorted(self.positions):
+            entry = self.positions[key]
+            yield key, entry[:-1], entry[-1]
+
+    def spill(self):
+        """Writes the positions in memory as a sorted run and clears them
+        """
+        run = tempfile.TemporaryFile(dir=self.tempDir)
+        for key, counts, moves in self.entries():
+            writeEntry(run, key, counts, moves)
+            for move, count in moves.items():
+                run.write(MOVE.pack(move, count))
+        self.runs.append(run)
+        self.positions = {}
+
+    def merged(self):
+        """Yields (key, counts, {move: count}) of every position by key, the
+        runs and the positions in memory added up
+        """
+        sources = [readRun(run) for run in self.runs] + [self.entries()]
+        current = None
+        for key, counts, moves in heapq.merge(*sources, key=lambda entry: entry[0]):
+            if current is not None and current[0] == key:
+                totals = current[1]
+                for number, count in enumerate(counts):
+                    totals[number] += count
+                for move, count in moves.items():
+                    current[2][move] = current[2].get(move, 0) + count
+            else:
+                if current is not None:
+                    yield current
+                current = (key, list(counts), dict(moves))
+        if current is not None:
+            yield current
+
+    def write(self, filepath):
+        """Writes the index, returns the number of positions
+        """
+        positions = 0
+        with open(filepath, 'wb') as file, tempfile.TemporaryFile(dir=self.tempDir) as movesFile:
+            # Counts are known after the merge, the header is written again at the end
+            file.write(HEADER.pack(MAGIC, VERSION, 0, 0, self.games, 0))
+
+            first = 0
+            for key, counts, moves in self.merged():
+                writeEntry(file, key, counts, moves, first)
+                first += len(moves)
+                positions += 1
+                for move in sorted(moves, key=lambda move: (-moves[move], move)):
+                    movesFile.write(MOVE.pack(move, moves[move]))
+
+            movesOffset = file.tell()
+            movesFile.seek(0)
+            shutil.copyfileobj(movesFile, file)
+
+            file.seek(0)
+            file.write(HEADER.pack(MAGIC, VERSION, 0, positions, self.games, movesOffset))
+
+        return positions
+
+    def close(self):
+        """Removes the spilled runs
+        """
+        for run in self.runs:
+            run.close()
+        self.runs = []
+
+
+def buildIndex(target, filepath, workers=None, maxPly=None, spillPositions=SPILL_POSITIONS):
+    """Parses every ptn file in target with TakReader.parseGames and writes the
+    position index. Returns (games, positions, list of (path, error)).
+    """
+    builder = IndexBuilder(maxPly, spillPositions)
+    errors = []
+    try:
+        for path, game, error in TakReader.parseGames(target, workers=workers):
+            if error:
+                errors.append((path, error))
+            else:
+                builder.add(game)
+        return builder.games, builder.write(filepath), errors
+    finally:
+        builder.close()
+
+
+# ====================================================
+#                      Reader
+# ====================================================
+
+class IndexReader(object):
+    """Memory-mapped position index, positions are found by binary search
+    """
+
+    def __init__(self, filepath):
+        self.file = open(filepath, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, reserved, self.count, self.games, self.movesOffset = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise ValueError("{} is not a Tak position index".format(filepath))
+        if version != VERSION:
+            raise ValueError("Unsupported Tak position index version {}".format(version))
+
+    def find(self, key):
+        """Returns the record offset of key, None if the position is not indexed
+        """
+        data = self.data
+        low = 0
+        high = self.count
+        while low < high:
+            middle = (low + high) // 2
+            offset = HEADER.size + middle*POSITION.size
+            found, = KEY.unpack_from(data, offset)
+            if found == key:
+                return offset
+            if found < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def lookup(self, key):
+        """Returns the PositionStats of a position key
+        """
+        offset = self.find(key)
+        if offset is None:
+            return PositionStats(key)
+
+        record = POSITION.unpack_from(self.data, offset)
+        games = record[1]
+        results = list(record[2:2+DRAWS+1])
+        first, count = record[-2:]
+
+        moves = []
+        offset = self.movesOffset + first*MOVE.size
+        for number in range(count):
+            moves.append(MOVE.unpack_from(self.data, offset))
+            offset += MOVE.size
+
+        return PositionStats(key, games, results, moves)
+
+    def query(self, position, size=None):
+        """Returns the PositionStats of a position: a Tak.Board, a BitBoard or
+        ptn text of the moves leading to it. Text without a Size header needs size.
+        """
+        if isinstance(position, str):
+            if size is not None:
+                position = '[Size "{}"]\n{}'.format(size, position)
+            game = TakReader.parseGameText(position)
+            if not game.size:
+                raise ValueError("The board size of a ptn prefix is needed")
+            position = game.board
+        return self.lookup(positionKey(position))
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, position):
+        return self.find(positionKey(position)) is not None
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Build or query a Tak position index')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help='index the positions of ptn files')
+    build.add_argument('path', help='ptn file, directory of ptn files or glob')
+    build.add_argument('index', help='index file to write')
+    build.add_argument('--workers', type=int, default=None)
+    build.add_argument('--plies', type=int, default=None, help='only index the first plies of every game')
+    build.add_argument('--positions', type=int, default=SPILL_POSITIONS, help='positions held in memory before spilling to disk')
+
+    query = commands.add_parser('query', help='show the stats of a position')
+    query.add_argument('index')
+    query.add_argument('ptn', nargs='?', default='', help='moves leading to the position, the start position if left out')
+    query.add_argument('--size', type=int, default=None)
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        games, positions, errors = buildIndex(args.path, args.index, workers=args.workers, maxPly=args.plies, spillPositions=args.positions)
+        for path, error in errors:
+            print("FAILED {} - {}".format(path, error))
+        print("Indexed {} positions from {} games, {} failed".format(positions, games, len(errors)))
+        return 1 if errors else 0
+
+    with IndexReader(args.index) as reader:
+        print(reader.query(args.ptn, args.size))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
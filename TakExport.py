@@ -0,0 +1,171 @@
+import sys
+import json
+import argparse
+
+import TakReader
+from Tak import COLORS
+from TakBitboard import BitBoard
+
+"""
+TakExport
+
+Streams parsed games out as JSON lines (NDJSON), one record per game and one
+line per record, so any number of games passes through in constant memory:
+
+    python TakExport.py games/ games.ndjson
+    python TakExport.py games/ --plies | gzip > games.ndjson.gz
+
+A record holds the ptn headers, the result fields set by
+TakReader.parseResult and the moves as ptn:
+
+    {"site": ..., "date": "2016-05-11", "white": ..., "black": ..., "size": 5,
+     "result": "R-0", "state": "complete", "winner": "white",
+     "winCondition": "road", "moves": ["a1", "e5", ...]}
+
+With plies, every position after a move is described as well, see plyRecords.
+ExportWriter can also write one JSON array instead of lines.
+"""
+
+BUFFER_SIZE = 1 << 16
+
+
+def memberName(member):
+    return member.name if member is not None else None
+
+
+def plyRecords(game):
+    """Returns a dict per move: ply number, top flat counts, roads and the
+    Zobrist hash (hex) of the position after it
+    """
+    output = []
+    board = BitBoard(game.size)
+    for ply, turn in enumerate(game.turns, 1):
+        board.apply(turn)
+        flats = board.flatCounts()
+        roads = board.roads()
+        output.append({
+            'ply'   : ply,
+            'move'  : turn.ptn(),
+            'flats' : [flats[COLORS.white], flats[COLORS.black]],
+            'roads' : [roads[COLORS.white], roads[COLORS.black]],
+            'hash'  : '{:016x}'.format(board.hash),
+        })
+    return output
+
+
+def gameRecord(game, plies=False):
+    """Returns the export record of a Tak.Game as a dict of JSON values
+    """
+    record = {
+        'site'         : game.host,
+        'date'         : game.date.isoformat() if game.date else None,
+        'white'        : game.players[COLORS.white].name,
+        'black'        : game.players[COLORS.black].name,
+        'size'         : game.size,
+        'result'       : game.ptn_result,
+        'state'        : memberName(game.state),
+        'winner'       : memberName(game.winner),
+        'winCondition' : memberName(game.winCondition),
+        'moves'        : [turn.ptn() for turn in game.turns],
+    }
+    if plies and game.size:
+        record['plies'] = plyRecords(game)
+    return record
+
+
+# ====================================================
+#                      Writer
+# ====================================================
+
+class ExportWriter(object):
+    """Writes game records to a file path, '-' for stdout, or an open text file.
+    Files opened by the writer are buffered and closed with it, use it as a
+    context manager. With lines=False the records form one JSON array.
+    """
+
+    def __init__(self, target, plies=False, lines=True, bufferSize=BUFFER_SIZE):
+        self.plies = plies
+        self.lines = lines
+        self.count = 0
+
+        if target == '-':
+            self.file = sys.stdout
+            self.owned = False
+        elif isinstance(target, str):
+            self.file = open(target, 'w', encoding='utf-8', buffering=bufferSize)
+            self.owned = True
+        else:
+            self.file = target
+            self.owned = False
+
+        if not lines:
+            self.file.write('[')
+
+    def add(self, game):
+        text = json.dumps(gameRecord(game, self.plies), separators=(',', ':'))
+        if not self.lines:
+            text = ('\n' if not self.count else ',\n') + text
+        else:
+            text += '\n'
+        self.file.write(text)
+        self.count += 1
+
+    def close(self):
+        if self.file is None:
+            return
+        if not self.lines:
+            self.file.write('\n]\n')
+        if self.owned:
+            self.file.close()
+        else:
+            self.file.flush()
+        self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def writeGames(target, games, plies=False, lines=True):
+    """Writes an iterable of Tak.Game objects, returns the count
+    """
+    with ExportWriter(target, plies, lines) as writer:
+        for game in games:
+            writer.add(game)
+        return writer.count
+
+
+def exportGames(path, target, workers=None, plies=False, lines=True):
+    """Parses every ptn file in path with TakReader.parseGames and writes them
+    as they arrive. Returns (games written, list of (path, error)).
+    """
+    errors = []
+    with ExportWriter(target, plies, lines) as writer:
+        for filepath, game, error in TakReader.parseGames(path, workers=workers):
+            if error:
+                errors.append((filepath, error))
+            else:
+                writer.add(game)
+        return writer.count, errors
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Export ptn files as JSON lines')
+    parser.add_argument('path', help='ptn file, directory of ptn files or glob')
+    parser.add_argument('output', nargs='?', default='-', help='file to write, stdout if left out')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--plies', action='store_true', help='add flat counts, roads and hash after every move')
+    parser.add_argument('--array', action='store_true', help='write one JSON array instead of JSON lines')
+    args = parser.parse_args(argv)
+
+    count, errors = exportGames(args.path, args.output, workers=args.workers, plies=args.plies, lines=not args.array)
+    for path, error in errors:
+        sys.stderr.write("FAILED {} - {}\n".format(path, error))
+    sys.stderr.write("Exported {} games, {} failed\n".format(count, len(errors)))
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
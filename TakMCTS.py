@@ -0,0 +1,461 @@
+import sys
+import copy
+import math
+import time
+import random
+import argparse
+from enum import Enum
+from concurrent.futures import ProcessPoolExecutor
+
+from Tak import COLORS, PIECES, Turn
+from TakMoves import fromTurn, toTurn, isStackMove, moveRow, moveFil, moveColor, movePiece
+from TakSearch import Position
+import TakReader
+
+"""
+TakMCTS
+
+Monte Carlo tree search engine. UCT selection over the TakMoves generator
+(the same moves, in the same order, as TakWinSolver.getAllMoves), with
+positions explored in place through Board.apply / Board.undo and results
+read through Tak.gameResult.
+
+Playout policies are pluggable, the tree is kept between moves (see
+MCTS.advance), and playouts can be spread over a process pool:
+
+    root    every worker grows its own tree from the root, the visit counts
+            of the root moves are merged back into this engine's tree
+    leaf    this engine grows the tree, descending leafBatch leaves per worker
+            each round with a virtual loss on every path so the descents
+            spread out. Each worker gets one chunk of leaves, sent as move
+            paths from the root, and plays them all out before replying.
+"""
+
+class PARALLEL(Enum):
+    '''Ways of spreading playouts over worker processes
+    '''
+    root = 0
+    leaf = 1
+
+
+# ====================================================
+#                 Playout Policies
+# ====================================================
+# A policy is policy(position, moves, rng) and returns one of moves. Policies
+# are module level functions so they can be sent to worker processes.
+
+def randomPolicy(position, moves, rng):
+    return moves[rng.randrange(len(moves))]
+
+
+ROAD_SAMPLES = 4
+
+def roadPolicy(position, moves, rng):
+    """Road greedy: samples a few moves and keeps the one that best extends
+    the mover's roads, flats and caps placed next to their own road pieces.
+    """
+    colors, pieces, heights = position.board.tops()
+    size = position.size
+
+    best = None
+    bestScore = -1
+    for sample in range(ROAD_SAMPLES):
+        move = moves[rng.randrange(len(moves))]
+        if isStackMove(move):
+            score = 1
+        elif movePiece(move) == PIECES.wall:
+            score = 0
+        else:
+            row = moveRow(move)
+            fil = moveFil(move)
+            color = moveColor(move)
+            score = 1
+            for neighbourRow, neighbourFil in ((row+1, fil), (row-1, fil), (row, fil+1), (row, fil-1)):
+                if 0 <= neighbourRow < size and 0 <= neighbourFil < size:
+                    index = neighbourRow*size + neighbourFil
+                    if colors[index] == color and pieces[index] != PIECES.wall:
+                        score += 1
+
+        if score > bestScore:
+            best = move
+            bestScore = score
+
+    return best
+
+
+# ====================================================
+#                       Tree
+# ====================================================
+
+class Node(object):
+
+    def __init__(self, move, mover, parent=None):
+        self.move     = move        # TakMoves code leading here, None at the root
+        self.mover    = mover       # color that made move
+        self.parent   = parent
+        self.children = []
+        self.untried  = None        # moves not expanded yet, listed on first visit
+        self.terminal = None        # winning color or False for a draw once the game is over
+        self.visits   = 0
+        self.wins     = 0.0         # from the point of view of mover
+
+    def child(self, move):
+        for child in self.children:
+            if child.move == move:
+                return child
+        return None
+
+
+def reward(result, mover):
+    if result is False:
+        return 0.5
+    if result == mover:
+        return 1.0
+    return 0.0
+
+
+class MCTS(Position):
+    """UCT search over a private copy of a game's position.
+    Budgets: iterations and timeLimit in seconds, whichever ends first.
+    With workers > 1 playouts run on a process pool kept until close.
+    """
+
+    def __init__(self, game=None, policy=randomPolicy, exploration=1.4, playoutLimit=None,
+                 workers=1, parallel=PARALLEL.root, seed=None, leafBatch=16):
+        self.policy       = policy
+        self.exploration  = exploration
+        self.playoutLimit = playoutLimit
+        self.workers      = workers
+        self.parallel     = parallel
+        self.leafBatch    = leafBatch   # leaves per worker in a leaf parallel round
+        self.seed         = seed
+        self.random       = random.Random(seed)
+        self.pool         = None
+
+        if game is not None:
+            flats = {color: game.players[color].flats for color in COLORS}
+            caps  = {color: game.players[color].caps for color in COLORS}
+            self.setState(copy.deepcopy(game.board), flats, caps, len(game.turns))
+
+    def setState(self, board, flats, caps, ply):
+        Position.setState(self, board, flats, caps, ply)
+        self.root = Node(None, None)
+        if self.playoutLimit is None:
+            self.playoutLimit = 4*board.size*board.size
+
+    # Tree policy
+
+    def select(self, node):
+        logVisits = math.log(node.visits)
+        exploration = self.exploration
+
+        def uct(child):
+            return child.wins/child.visits + exploration*math.sqrt(logVisits/child.visits)
+
+        return max(node.children, key=uct)
+
+    def expand(self, node):
+        if node.untried is None:
+            node.untried = self.moves()
+            self.random.shuffle(node.untried)
+        if not node.untried:
+            return node
+
+        move = node.untried.pop()
+        mover = self.toMove()
+        self.make(move)
+        child = Node(move, mover, node)
+        child.terminal = self.outcome(mover)
+        node.children.append(child)
+        return child
+
+    def descend(self):
+        """Walks the tree from the root to a new or terminal node, making the
+        moves on the way. Returns the node.
+        """
+        node = self.root
+        while node.terminal is None and node.untried is not None and not node.untried and node.children:
+            node = self.select(node)
+            self.make(node.move)
+
+        if node.terminal is None:
+            node = self.expand(node)
+        return node
+
+    def backup(self, node, results):
+        while node is not None:
+            for result in results:
+                node.visits += 1
+                node.wins += reward(result, node.mover)
+            node = node.parent
+
+    # Playouts
+
+    def playout(self):
+        """Plays the policy from the current position until the game ends or
+        playoutLimit plies pass, then scores by flat count. Returns the winning
+        color or False for a draw. Moves are left on the board, see unwind.
+        """
+        for step in range(self.playoutLimit):
+            moves = self.moves()
+            if not moves:
+                return False
+
+            mover = self.toMove()
+            self.make(self.policy(self, moves, self.random))
+            result = self.outcome(mover)
+            if result is not None:
+                return result
+
+        return self.flatWinner()
+
+    def leafResult(self, node):
+        """Result of a node without a playout, None if it needs one
+        """
+        if node.terminal is not None:
+            return node.terminal
+        if node.untried is not None and not node.untried and not node.children:
+            # No legal moves
+            return False
+        return None
+
+    # Search
+
+    def iterate(self):
+        node = self.descend()
+        result = self.leafResult(node)
+        if result is None:
+            result = self.playout()
+        self.unwind()
+        self.backup(node, [result])
+
+    def iterateLeaves(self, count):
+        """One leaf parallel round over count leaves. Returns count.
+        """
+        nodes = []
+        results = []
+        pending = []
+        for leaf in range(count):
+            node = self.descend()
+            result = self.leafResult(node)
+            if result is None:
+                pending.append((len(nodes), [move for move, record in self.line]))
+            self.unwind()
+
+            # Virtual loss: the path counts as visited and lost until backed up
+            parent = node
+            while parent is not None:
+                parent.visits += 1
+                parent = parent.parent
+            nodes.append(node)
+            results.append(result)
+
+        if pending:
+            state = self.state()
+            chunks = [pending[worker::self.workers] for worker in range(self.workers)]
+            futures = [
+                self.getPool().submit(leafWorker, state, [path for number, path in chunk], self.policy, self.playoutLimit, self.random.getrandbits(32))
+                for chunk in chunks if chunk
+            ]
+            for chunk, future in zip([chunk for chunk in chunks if chunk], futures):
+                for (number, path), result in zip(chunk, future.result()):
+                    results[number] = result
+
+        for node, result in zip(nodes, results):
+            parent = node
+            while parent is not None:
+                parent.visits -= 1
+                parent = parent.parent
+            self.backup(node, [result])
+
+        return count
+
+    def run(self, iterations=None, deadline=None):
+        leaves = self.workers > 1 and self.parallel == PARALLEL.leaf
+        count = 0
+        while iterations is None or count < iterations:
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            if leaves:
+                batch = self.workers*self.leafBatch
+                if iterations is not None:
+                    batch = min(batch, iterations - count)
+                count += self.iterateLeaves(batch)
+            else:
+                self.iterate()
+                count += 1
+        return count
+
+    def search(self, iterations=None, timeLimit=None):
+        """Grows the tree, returns the most visited move as a Tak.Turn.
+        Without any budget 1000 iterations are run.
+        """
+        if iterations is None and timeLimit is None:
+            iterations = 1000
+        deadline = time.perf_counter() + timeLimit if timeLimit is not None else None
+
+        if self.workers > 1 and self.parallel == PARALLEL.root:
+            self.searchRoots(iterations, timeLimit)
+        else:
+            self.run(iterations, deadline)
+
+        move = self.bestMove()
+        return toTurn(move) if move is not None else None
+
+    def searchRoots(self, iterations, timeLimit):
+        share = None
+        if iterations is not None:
+            share = [iterations // self.workers + (worker < iterations % self.workers) for worker in range(self.workers)]
+
+        state = self.state()
+        futures = [
+            self.getPool().submit(
+                rootWorker,
+                state,
+                self.policy,
+                self.exploration,
+                self.playoutLimit,
+                share[worker] if share else None,
+                timeLimit,
+                self.random.getrandbits(32)
+            )
+            for worker in range(self.workers)
+        ]
+        for future in futures:
+            self.merge(future.result())
+
+    def merge(self, stats):
+        """Adds (move, visits, wins) root statistics from another tree
+        """
+        root = self.root
+        if root.untried is None:
+            root.untried = self.moves()
+            self.random.shuffle(root.untried)
+
+        for move, visits, wins in stats:
+            child = root.child(move)
+            if child is None:
+                mover = self.toMove()
+                self.make(move)
+                child = Node(move, mover, root)
+                child.terminal = self.outcome(mover)
+                self.unwind()
+                root.children.append(child)
+                if move in root.untried:
+                    root.untried.remove(move)
+
+            child.visits += visits
+            child.wins += wins
+            root.visits += visits
+
+    # Results
+
+    def rootStats(self):
+        """Returns (move, visits, wins) for every expanded root move, most visited first
+        """
+        stats = [(child.move, child.visits, child.wins) for child in self.root.children]
+        stats.sort(key=lambda stat: -stat[1])
+        return stats
+
+    def bestMove(self):
+        if not self.root.children:
+            return None
+        return max(self.root.children, key=lambda child: child.visits).move
+
+    def advance(self, move):
+        """Plays a move (TakMoves code or Tak.Turn) and keeps its subtree as the
+        new root, so the statistics gathered for it are reused.
+        """
+        if isinstance(move, Turn):
+            move = fromTurn(move)
+
+        child = self.root.child(move)
+        mover = self.toMove()
+        self.make(move)
+        self.line = []
+
+        if child is None:
+            child = Node(move, mover)
+            child.terminal = self.outcome(mover)
+        child.parent = None
+        self.root = child
+
+    # Worker pool
+
+    def getPool(self):
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self.pool
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# ====================================================
+#                      Workers
+# ====================================================
+
+def rootWorker(state, policy, exploration, playoutLimit, iterations, timeLimit, seed):
+    engine = MCTS(policy=policy, exploration=exploration, playoutLimit=playoutLimit, seed=seed)
+    engine.setState(*state)
+    deadline = time.perf_counter() + timeLimit if timeLimit is not None else None
+    engine.run(iterations, deadline)
+    return engine.rootStats()
+
+
+def leafWorker(state, paths, policy, playoutLimit, seed):
+    """Plays out the position after each path of moves from the root state,
+    returns the results in order
+    """
+    engine = MCTS(policy=policy, playoutLimit=playoutLimit, seed=seed)
+    engine.setState(*state)
+    results = []
+    for path in paths:
+        for move in path:
+            engine.make(move)
+        results.append(engine.playout())
+        engine.unwind()
+    return results
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Monte Carlo tree search on a ptn game')
+    parser.add_argument('path', help='ptn file, the position after its last move is searched')
+    parser.add_argument('--iterations', type=int, default=1000)
+    parser.add_argument('--seconds', type=float, default=None)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--leaf', action='store_true', help='leaf parallel instead of root parallel')
+    parser.add_argument('--leaf-batch', type=int, default=16, help='leaves per worker in each leaf parallel round')
+    parser.add_argument('--road', action='store_true', help='road greedy playouts')
+    args = parser.parse_args(argv)
+
+    game = TakReader.readGame(args.path)
+    engine = MCTS(
+        game,
+        policy=roadPolicy if args.road else randomPolicy,
+        workers=args.workers,
+        parallel=PARALLEL.leaf if args.leaf else PARALLEL.root,
+        leafBatch=args.leaf_batch
+    )
+    with engine:
+        start = time.perf_counter()
+        turn = engine.search(args.iterations, args.seconds)
+        seconds = time.perf_counter() - start
+
+    print(game.board)
+    for move, visits, wins in engine.rootStats()[:10]:
+        print("{:8} {:6} visits {:.3f}".format(toTurn(move).ptn(), visits, wins/visits))
+    print("best {} in {:.2f}s".format(turn.ptn() if turn else None, seconds))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
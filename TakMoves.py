@@ -0,0 +1,237 @@
+import re
+
+from Tak import COLORS, DIRECTIONS, PIECES, Turn, getDirectionMods, getSpace, symbolToDirection
+from TakDrops import getDropTable, packDrops, unpackDrops
+from TakStats import STATS, MOVEGEN
+
+"""
+TakMoves
+
+Compact integer move encoding and a streaming move generator.
+
+A move is a single int:
+
+    bits 0-3    row
+    bits 4-7    fil
+    bit  8      color, set for black
+    bit  9      set for stack moves, clear for placements
+    bits 10-11  piece value for placements, direction value for stack moves
+    bits 12+    drops for stack moves, 4 bits per drop (see TakDrops.packDrops)
+
+Moves only allocate when they are turned into Tak.Turn objects or PTN text,
+so search code can scan move lists lazily and stop early.
+"""
+
+ROW_MASK    = 0xf
+FIL_SHIFT   = 4
+FIL_MASK    = 0xf << FIL_SHIFT
+BLACK       = 1 << 8
+MOVE        = 1 << 9
+KIND_SHIFT  = 10
+KIND_MASK   = 0x3 << KIND_SHIFT
+DROPS_SHIFT = 12
+
+_PIECES     = list(PIECES)
+_DIRECTIONS = list(DIRECTIONS)
+
+# Interned drop tuples so decoding moves shares one tuple per sequence
+_DROPS = {}
+
+# Optional count, optional piece, square, optional direction with optional drops
+PTN_MOVE = re.compile(r"([1-9])?([CS])?([a-iA-I])([1-9])(?:([-+<>])([1-9]*))?")
+
+
+# ====================================================
+#                     Encoding
+# ====================================================
+
+def placement(row, fil, color, piece=PIECES.flat):
+    output = row | fil << FIL_SHIFT | piece.value << KIND_SHIFT
+    if color == COLORS.black:
+        output |= BLACK
+    return output
+
+
+def stackMove(row, fil, color, direction, drops):
+    output = row | fil << FIL_SHIFT | MOVE | direction.value << KIND_SHIFT | packDrops(drops) << DROPS_SHIFT
+    if color == COLORS.black:
+        output |= BLACK
+    return output
+
+
+def moveRow(move):
+    return move & ROW_MASK
+
+def moveFil(move):
+    return (move & FIL_MASK) >> FIL_SHIFT
+
+def moveColor(move):
+    return COLORS.black if move & BLACK else COLORS.white
+
+def isStackMove(move):
+    return bool(move & MOVE)
+
+def movePiece(move):
+    """Piece placed by a placement, None for stack moves
+    """
+    if move & MOVE:
+        return None
+    return _PIECES[(move & KIND_MASK) >> KIND_SHIFT]
+
+def moveDirection(move):
+    """Direction of a stack move, None for placements
+    """
+    if move & MOVE:
+        return _DIRECTIONS[(move & KIND_MASK) >> KIND_SHIFT]
+    return None
+
+def moveDrops(move):
+    """Drop sequence of a stack move as a shared tuple, () for placements
+    """
+    packed = move >> DROPS_SHIFT
+    drops = _DROPS.get(packed)
+    if drops is None:
+        drops = _DROPS[packed] = unpackDrops(packed)
+    return drops
+
+
+# ====================================================
+#                  Turn and PTN
+# ====================================================
+
+def toTurn(move):
+    """Returns the Tak.Turn for a move
+    """
+    space = getSpace(move & ROW_MASK, (move & FIL_MASK) >> FIL_SHIFT)
+    if move & MOVE:
+        return Turn(moveColor(move), space, isMove=True, direction=moveDirection(move), drops=moveDrops(move))
+    return Turn(moveColor(move), space, piece=movePiece(move))
+
+
+def fromTurn(turn):
+    """Returns the move for a Tak.Turn
+    """
+    if turn.isMove:
+        return stackMove(turn.space.row, turn.space.fil, turn.color, turn.direction, turn.drops)
+    return placement(turn.space.row, turn.space.fil, turn.color, turn.piece)
+
+
+def toPtn(move):
+    return toTurn(move).ptn()
+
+
+def fromPtn(text, color):
+    """Returns the move for a PTN move such as 3c3>12 or Sb2.
+    color is the color of the placed stone, or of the player moving a stack.
+    """
+    match = PTN_MOVE.fullmatch(text)
+    if not match:
+        raise ValueError("Invalid PTN move: {}".format(text))
+
+    picks, pieceName, fil, row, directionSymbol, drops = match.groups()
+    row = int(row)-1
+    fil = ord(fil.lower()) - ord('a')
+
+    if directionSymbol is None:
+        if picks:
+            raise ValueError("Invalid PTN move: {}, placements have no stone count".format(text))
+        piece = PIECES.flat
+        if pieceName == 'C':
+            piece = PIECES.cap
+        elif pieceName == 'S':
+            piece = PIECES.wall
+        return placement(row, fil, color, piece)
+
+    if drops:
+        drops = [int(drop) for drop in drops]
+        if picks and int(picks) != sum(drops):
+            raise ValueError("Invalid PTN move: {}, picks up {} stones but drops {}".format(text, picks, sum(drops)))
+    else:
+        drops = [int(picks) if picks else 1]
+    return stackMove(row, fil, color, symbolToDirection(directionSymbol), drops)
+
+
+# ====================================================
+#                  Move Generation
+# ====================================================
+
+def generateMoves(board, color, flats, caps, firstTurn=False):
+    """Yields every move for color as an int, in the same order as getAllMoves.
+    flats and caps are the stones color has left to place. On the first turn
+    only flats are placed, and color is the color of the placed stone.
+    """
+    moves = boardMoves(board, color, flats, caps, firstTurn)
+    if STATS.enabled:
+        return STATS.timedIterator(MOVEGEN, moves, 'moves')
+    return moves
+
+
+def boardMoves(board, color, flats, caps, firstTurn):
+    # generateMoves without instrumentation
+    size = board.size
+    drops = getDropTable(size)
+    colors, pieces, heights = board.tops()
+
+    colorBits = BLACK if color == COLORS.black else 0
+    wallBits = PIECES.wall.value << KIND_SHIFT
+    capBits = PIECES.cap.value << KIND_SHIFT
+    mods = [(direction.value << KIND_SHIFT, getDirectionMods(direction)) for direction in DIRECTIONS]
+
+    index = 0
+    for x in range(size):
+        for y in range(size):
+            base = x | y << FIL_SHIFT | colorBits
+
+            # Placements
+            if not heights[index]:
+                if flats > 0:
+                    #  Flats
+                    yield base
+                    #  Walls
+                    if not firstTurn:
+                        yield base | wallBits
+                if caps > 0 and not firstTurn:
+                    #  Caps
+                    yield base | capBits
+
+            # Moves
+            #  stack move permutations from max drop to min (shortest move to longest)
+            elif colors[index] == color and not firstTurn:
+                isCap = pieces[index] == PIECES.cap
+                for picks in range(1, min(size, heights[index])+1):
+                    sequences = drops.packedSequences[picks]
+                    flattens = drops.packedFlattens[picks]
+                    for directionBits, (xmod, ymod) in mods:
+                        moveBase = base | MOVE | directionBits
+                        for moveSpaces in range(1, picks+1):
+                            xcheck = x+xmod*moveSpaces
+                            ycheck = y+ymod*moveSpaces
+
+                            if xcheck < 0 or xcheck >= size or ycheck < 0 or ycheck >= size:
+                                #reached an off board square, move to next direction
+                                break
+
+                            piece = pieces[xcheck*size + ycheck]
+                            if piece == PIECES.cap:
+                                # can't stack onto a cap
+                                break
+
+                            elif piece == PIECES.wall:
+                                # write moves for flattening a wall, only the cap can drop onto it
+                                if isCap:
+                                    for packed in flattens[moveSpaces]:
+                                        yield moveBase | packed << DROPS_SHIFT
+                                break
+
+                            else:
+                                for packed in sequences[moveSpaces]:
+                                    yield moveBase | packed << DROPS_SHIFT
+
+            index += 1
+
+
+def gameMoves(game, color):
+    """Yields every move for color in a Tak.Game, see generateMoves
+    """
+    player = game.players[color]
+    return generateMoves(game.board, color, player.flats, player.caps, len(game.turns) < 2)
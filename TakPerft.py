@@ -0,0 +1,179 @@
+import sys
+import time
+import argparse
+
+from TakMoves import toPtn
+from TakSearch import Position
+import TakReader
+
+"""
+TakPerft
+
+Move generation benchmark and validation. perft counts the positions reached
+after exactly depth plies, following every legal move. Games that end on the
+way (a road, a full board or an empty reserve) are counted once and not
+explored further.
+
+REFERENCE holds known counts for the start position and one midgame position
+of every board size, plus a 7x7 position with both capstones of each player
+placed. A change to move generation, the reserves, Board.apply or the road
+tracker that alters any count shows up as a failed check:
+
+    python TakPerft.py --check
+    python TakPerft.py --size 6 --depth 3
+    python TakPerft.py --ptn game.ptn --depth 2 --divide
+"""
+
+# (name, size, ptn moves, counts for depth 1, 2, ...)
+REFERENCE = [
+    ('start',  3, '', [9, 72, 1200, 17792, 271812]),
+    ('start',  4, '', [16, 240, 7440, 216464]),
+    ('start',  5, '', [25, 600, 43320, 2999784]),
+    ('start',  6, '', [36, 1260, 132720]),
+    ('start',  7, '', [49, 2352, 339696]),
+    ('start',  8, '', [64, 4032, 764064]),
+
+    ('middle', 3, '1. a1 b2 2. a2 a1+ 3. b2< Sc2', [23, 366, 7052, 102778]),
+    ('middle', 4, '1. a3 a4 2. a4- Sa2 3. d2 a2+ 4. d2- 3a3- 5. b1 3a2+', [31, 1226, 37090, 1256055]),
+    ('middle', 5, '1. e4 a5 2. Sa3 c4 3. a3- Cc3 4. e5 c4< 5. a2- Se3 6. a1+ b5 7. a5> c5 8. 2b5- Sc4', [69, 3224, 194333]),
+    ('middle', 6, '1. f5 c4 2. Se5 f5- 3. Cf5 f2 4. f5- f3 5. Sa6 e4 6. Se1 Sb1 7. Sb4 Cf5 8. b3 f2< 9. 2f4- b1< 10. c4> e4<', [83, 5772, 459040]),
+    ('middle', 7, '1. a7 a5 2. f2 a7- 3. f1 d2 4. e7 a6- 5. f1< Sd4 6. e1< d2> 7. e7- e2- 8. f2- Sb6 9. f1+ b6- 10. Sf6 b5< 11. d1< Cc3 12. Sc6 Sd2', [135, 20076, 2647485]),
+    ('middle', 8, '1. c7 d8 2. Sh5 c7> 3. d8< Sa2 4. Ce2 d7+ 5. Sf6 Cf8 6. c8> Sg7 7. c7 g7- 8. 2d8- g6- 9. e4 Cc2 10. e4< f4 11. d4> b2 12. Ch2 a7 13. d7< d7< 14. f6> f4>', [118, 16865, 1991556]),
+
+    # Both capstones of each player placed, 7x7 and up start with two
+    ('caps',   7, '1. a1 g7 2. Cd4 Ce4 3. Cd5 Ce5', [92, 8294, 758276]),
+]
+
+
+class Perft(Position):
+    """Counts leaf positions from a Tak.Game. The game's board is explored in
+    place and restored after every count.
+    """
+
+    def __init__(self, game):
+        self.setup(game)
+
+    def count(self, depth):
+        if depth == 0:
+            return 1
+
+        moves = self.moves()
+        if depth == 1:
+            # Leaves don't need to be played to be counted
+            return len(moves)
+
+        mover = self.toMove()
+        nodes = 0
+        for move in moves:
+            record = self.make(move)
+            if self.outcome(mover) is None:
+                nodes += self.count(depth-1)
+            else:
+                nodes += 1
+            self.unmake(move, record)
+        return nodes
+
+    def divide(self, depth):
+        """Returns (move, count) for every move of the side to move
+        """
+        mover = self.toMove()
+        output = []
+        for move in self.moves():
+            record = self.make(move)
+            if depth <= 1 or self.outcome(mover) is not None:
+                nodes = 1
+            else:
+                nodes = self.count(depth-1)
+            self.unmake(move, record)
+            output.append((move, nodes))
+        return output
+
+
+def makeGame(size, moves=''):
+    """Returns a Tak.Game of size after the numbered ptn moves
+    """
+    return TakReader.parseGameText('[Size "{}"]\n{}\n'.format(size, moves))
+
+
+def perft(game, depth):
+    """Returns (nodes, seconds)
+    """
+    start = time.perf_counter()
+    nodes = Perft(game).count(depth)
+    return nodes, time.perf_counter() - start
+
+
+def nps(nodes, seconds):
+    if seconds <= 0:
+        return 0
+    return int(nodes / seconds)
+
+
+def checkReference(maxDepth=None, report=print):
+    """Runs every REFERENCE position, up to maxDepth if given.
+    Returns the list of (name, size, depth, expected, counted) that differ.
+    """
+    failures = []
+    totalNodes = 0
+    totalSeconds = 0
+
+    for name, size, moves, counts in REFERENCE:
+        game = makeGame(size, moves)
+        for depth, expected in enumerate(counts, 1):
+            if maxDepth is not None and depth > maxDepth:
+                break
+
+            nodes, seconds = perft(game, depth)
+            totalNodes += nodes
+            totalSeconds += seconds
+
+            status = 'ok'
+            if nodes != expected:
+                status = 'FAILED, expected {}'.format(expected)
+                failures.append((name, size, depth, expected, nodes))
+
+            report("{:6} {}x{} depth {} - {:>9} nodes {:>8} nps - {}".format(
+                name, size, size, depth, nodes, nps(nodes, seconds), status
+            ))
+
+    report("{} failed, {} nodes in {:.2f}s, {} nps".format(
+        len(failures), totalNodes, totalSeconds, nps(totalNodes, totalSeconds)
+    ))
+    return failures
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Count Tak move generation leaf nodes')
+    parser.add_argument('--check', action='store_true', help='compare against the reference counts')
+    parser.add_argument('--size', type=int, default=5)
+    parser.add_argument('--depth', type=int, default=None, help='plies to count, 3 by default, every reference depth with --check')
+    parser.add_argument('--ptn', help='start from the position after the moves of a ptn file')
+    parser.add_argument('--divide', action='store_true', help='count per first move')
+    args = parser.parse_args(argv)
+
+    if args.check:
+        failures = checkReference(args.depth)
+        return 1 if failures else 0
+
+    depth = args.depth or 3
+    if args.ptn:
+        game = TakReader.readGame(args.ptn)
+    else:
+        game = makeGame(args.size)
+
+    if args.divide:
+        total = 0
+        for move, nodes in Perft(game).divide(depth):
+            print("{:10} {}".format(toPtn(move), nodes))
+            total += nodes
+        print("{} nodes".format(total))
+        return 0
+
+    for ply in range(1, depth+1):
+        nodes, seconds = perft(game, ply)
+        print("depth {} - {} nodes in {:.2f}s, {} nps".format(ply, nodes, seconds, nps(nodes, seconds)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,7 +1,17 @@
 import sys
+import os
 import os.path
+import re
+import glob
+import logging
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from datetime import date
+from time import perf_counter
 import TakWinSolver
+import TakStats
+from TakStats import STATS, PARSE
 
 # First Party
 import Tak
@@ -10,10 +20,13 @@ import Tak
 TakReader
 
 Given a ptn file from playtak.com, this will convert the data into a usable
-object (TakGame) or convert into an output format, such as json
+object (TakGame) or convert into an output format, such as json (see TakExport)
 
 """
 
+logger = logging.getLogger(__name__)
+
+
 def parseLine(game, text):
     # remove new line character if present (all but final line of file)
     if text[-1] == "\n":
@@ -36,7 +49,7 @@ def parseTurnLine(game, text):
     indexSplit = text.split('. ')
 
     firstTurn = indexSplit[0] == '1'
-    print(" - Turn: {}".format(indexSplit[1]))
+    logger.debug(" - Turn: %s", indexSplit[1])
     turnsSplit = indexSplit[1].split(' ')
 
     if firstTurn:
@@ -76,7 +89,7 @@ def parseTurn(game, text, color):
     row = int(modText[1])-1
     modText = modText[2:]
 
-    space = Tak.Space(row, fil)
+    space = Tak.getSpace(row, fil)
 
     direction = 0
 
@@ -97,29 +110,29 @@ def parseTurn(game, text, color):
     game.addTurn( turn )
 
 
+LETTERS = {
+    'a' : 1,
+    'b' : 2,
+    'c' : 3,
+    'd' : 4,
+    'e' : 5,
+    'f' : 6,
+    'g' : 7,
+    'h' : 8,
+    'i' : 9,
+    'A' : 1,
+    'B' : 2,
+    'C' : 3,
+    'D' : 4,
+    'E' : 5,
+    'F' : 6,
+    'G' : 7,
+    'H' : 8,
+    'I' : 9
+}
+
 def letterToNumber(letter):
-    data = {
-        'a' : 1,
-        'b' : 2,
-        'c' : 3,
-        'd' : 4,
-        'e' : 5,
-        'f' : 6,
-        'g' : 7,
-        'h' : 8,
-        'i' : 9,
-        'A' : 1,
-        'B' : 2,
-        'C' : 3,
-        'D' : 4,
-        'E' : 5,
-        'F' : 6,
-        'G' : 7,
-        'H' : 8,
-        'I' : 9
-    }
-
-    return data[letter]
+    return LETTERS[letter]
 
 
 def parseHeader(game, text):
@@ -130,6 +143,10 @@ def parseHeader(game, text):
     key = splits[0]
     value = splits[1][1:-1] # Assume wrapped in "
 
+    setHeader(game, key, value)
+
+
+def setHeader(game, key, value):
     if   key == 'Site':
         game.host = value
 
@@ -145,8 +162,7 @@ def parseHeader(game, text):
         game.size = int(value)
         game.board = Tak.Board(game.size)
 
-        numFlats = [10,15,21,30,40,50][game.size-3]
-        numCaps = [0,0,1,1,1,2,2][game.size-3]
+        numFlats, numCaps = Tak.startingReserves(game.size)
 
         game.players[Tak.COLORS.black].flats = numFlats
         game.players[Tak.COLORS.white].flats = numFlats
@@ -185,28 +201,242 @@ def parseResult(game, key, value):
             game.winCondition = Tak.WINS.time
 
 
-def parseGame(filepath):
+# ====================================================
+#                    Fast Parser
+#
+# Single pass over the whole file with one compiled
+# grammar. Handles comments, annotations and multi digit
+# move numbers, and prints nothing.
+# ====================================================
+
+PTN_TOKENS = re.compile(r"""
+    \s+
+  | (?P<header>\[\s*(?P<key>\w+)\s+"(?P<value>[^"]*)"\s*\])
+  | (?P<comment>\{[^}]*\})
+  | (?P<result>[RF10]-[RF10]|1/2-1/2)
+  | (?P<number>\d+\.)
+  | (?P<move>(?P<picks>[1-9])?(?P<piece>[CS])?(?P<fil>[a-iA-I])(?P<row>[1-9])(?:(?P<direction>[-+<>])(?P<drops>[1-9]*))?)(?P<annotation>['"!?*]*)
+  | (?P<error>\S+)
+""", re.VERBOSE)
+
+PLACEMENTS = {
+    None : Tak.PIECES.flat,
+    'C'  : Tak.PIECES.cap,
+    'S'  : Tak.PIECES.wall,
+}
+
+
+def parseGameText(text, validate=True):
+    """Parses the full text of a ptn file into a Tak.Game
+    Raises ValueError on text that is not ptn, Tak.IllegalMoveError (also a
+    ValueError) on moves the rules don't allow unless validate is False.
+    """
+    start = perf_counter() if STATS.enabled else None
 
     game = Tak.Game()
+    game.validateTurns = validate
+    ply = 0
+
+    for match in PTN_TOKENS.finditer(text):
+        kind = match.lastgroup
+
+        # A move, lastgroup is the trailing (possibly empty) annotation
+        if kind == 'annotation':
+            if ply < 2:
+                # First turn of each player places the opponent's stone
+                color = Tak.COLORS.black if ply == 0 else Tak.COLORS.white
+            else:
+                color = Tak.COLORS.white if ply % 2 == 0 else Tak.COLORS.black
+
+            space = Tak.getSpace(int(match.group('row'))-1, LETTERS[match.group('fil')]-1)
+
+            picks = match.group('picks')
+            directionSymbol = match.group('direction')
+            if directionSymbol:
+                drops = match.group('drops')
+                if drops:
+                    drops = [int(drop) for drop in drops]
+                    if picks and int(picks) != sum(drops):
+                        line = text.count('\n', 0, match.start()) + 1
+                        raise ValueError("Move '{}' on line {} picks up {} stones but drops {}".format(match.group('move'), line, picks, sum(drops)))
+                else:
+                    drops = [int(picks) if picks else 1]
+                turn = Tak.Turn(color, space, True, Tak.symbolToDirection(directionSymbol), drops)
+            else:
+                if picks:
+                    line = text.count('\n', 0, match.start()) + 1
+                    raise ValueError("Placement '{}' on line {} has a stone count".format(match.group('move'), line))
+                turn = Tak.Turn(color, space, piece=PLACEMENTS[match.group('piece')])
+
+            if game.state == Tak.STATES.new:
+                game.state = Tak.STATES.playing
+            game.recordTurn(turn)
+            ply += 1
+
+        elif kind == 'header':
+            setHeader(game, match.group('key'), match.group('value'))
+
+        elif kind == 'result':
+            # Result after the moves, the header takes precedence
+            if game.ptn_result is None:
+                parseResult(game, 'Result', match.group('result'))
+
+        elif kind == 'error':
+            line = text.count('\n', 0, match.start()) + 1
+            raise ValueError("Unexpected '{}' on line {}".format(match.group('error'), line))
+
+    if start is not None:
+        STATS.stop(PARSE, start)
+        STATS.count('plies', ply)
+    return game
+
 
+def readGame(filepath, validate=True):
+    """Fast, quiet equivalent of parseGame
+    """
     with open(filepath, 'r') as file:
-        print("Reading Game File")
-        index = 0
-        for line in file:
-            parseLine(game, line)
+        return parseGameText(file.read(), validate)
+
 
+def parseGame(filepath):
+
+    game = Tak.Game()
 
-    print("Finished Reading.")
+    with STATS.timer(PARSE):
+        with open(filepath, 'r') as file:
+            logger.info("Reading Game File %s", filepath)
+            for line in file:
+                parseLine(game, line)
+
+    logger.info("Finished Reading.")
 
     return game
 
 
+# ====================================================
+#                    Batch Import
+#
+# Parses many ptn files across a process pool. Results
+# are (filepath, game, error) tuples, error is None on
+# success and a message when the file failed to parse.
+# ====================================================
+
+def findGameFiles(target, pattern='*.ptn'):
+    """Returns a sorted list of ptn files for a directory (searched recursively),
+    a glob such as games/2016-*.ptn, or a single file
+    """
+    if os.path.isdir(target):
+        return sorted(glob.glob(os.path.join(target, '**', pattern), recursive=True))
+    if os.path.isfile(target):
+        return [target]
+    return sorted(glob.glob(target, recursive=True))
+
+
+def parseGameSafe(filepath, validate=True):
+    """Parses one file for the batch importer, errors are returned instead of raised
+    """
+    try:
+        return (filepath, readGame(filepath, validate), None)
+    except Exception as error:
+        return (filepath, None, "{}: {}".format(type(error).__name__, error))
+
+
+def parseGames(target, workers=None, ordered=True, maxPending=None, pattern='*.ptn', validate=True):
+    """Yields (filepath, game, error) for every ptn file in target.
+
+    target is a directory, glob or list of file paths. Files are parsed on a pool
+    of worker processes (workers=None uses one per cpu, workers=1 parses in this
+    process). At most maxPending files are queued at once, so memory stays
+    bounded however large the archive is. With ordered=False results are
+    yielded as they complete instead of in file order. validate=False skips
+    the rule checks for trusted files.
+    """
+    if isinstance(target, str):
+        paths = findGameFiles(target, pattern)
+    else:
+        paths = list(target)
+
+    if workers == 1:
+        for filepath in paths:
+            yield parseGameSafe(filepath, validate)
+        return
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if maxPending is None:
+        maxPending = workers * 4
+
+    paths = iter(paths)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for filepath in paths:
+            pending.append(pool.submit(parseGameSafe, filepath, validate))
+            if len(pending) >= maxPending:
+                break
+
+        while pending:
+            if ordered:
+                done = [pending.popleft()]
+            else:
+                finished, unfinished = wait(pending, return_when=FIRST_COMPLETED)
+                done = list(finished)
+                pending = deque(future for future in pending if future in unfinished)
+
+            for future in done:
+                yield future.result()
+
+            # Refill the queue as results are handed out
+            for filepath in paths:
+                pending.append(pool.submit(parseGameSafe, filepath, validate))
+                if len(pending) >= maxPending:
+                    break
+
+
+def importGames(target, workers=None, ordered=True):
+    """Batch import entry point for the command line.
+    Prints one line per file and a summary, returns the number of failed files.
+    """
+    parsed = 0
+    failed = 0
+    for filepath, game, error in parseGames(target, workers=workers, ordered=ordered):
+        if error:
+            failed += 1
+            print("FAILED {} - {}".format(filepath, error))
+        else:
+            parsed += 1
+            print("{} - {}".format(filepath, game))
+
+    print("Imported {} games, {} failed".format(parsed, failed))
+    return failed
+
+
 def main(argv):
-    filepath = argv[0]
+    parser = argparse.ArgumentParser(description='Read ptn files from playtak.com')
+    parser.add_argument('path', help='ptn file, directory of ptn files or glob')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes for batch imports, defaults to one per cpu')
+    parser.add_argument('--unordered', action='store_true', help='report batch results as they complete')
+    parser.add_argument('--verbose', '-v', action='count', default=0, help='log file progress, twice to log every turn')
+    parser.add_argument('--stats', nargs='?', const='-', default=None, help='print parse and apply stats, or write them as JSON to a file')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=[logging.WARNING, logging.INFO, logging.DEBUG][min(args.verbose, 2)], format='%(message)s')
+    if args.stats:
+        TakStats.enable()
+
+    filepath = args.path
+    failed = 0
     if os.path.isfile(filepath):
         game = parseGame(filepath)
         print(game.board)
         print(game)
+    else:
+        failed = importGames(filepath, workers=args.workers, ordered=not args.unordered)
+
+    if args.stats == '-':
+        print(TakStats.summary())
+    elif args.stats:
+        TakStats.writeJson(args.stats)
+    return 1 if failed else 0
 
         # testWinSolver(game)
         # testMoveFinder(game)
@@ -230,5 +460,5 @@ def testMoveFinder(game):
 
 if __name__ == '__main__':
 
-    main(sys.argv[1:])
+    sys.exit(main(sys.argv[1:]))
     # game = Tak.Game()
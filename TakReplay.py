@@ -0,0 +1,146 @@
+import sys
+import argparse
+
+from Tak import COLORS, startingReserves
+from TakBitboard import BitBoard
+from TakMoves import fromTurn, toTurn
+from TakSearch import Position
+import TakReader
+
+"""
+TakReplay
+
+Random access to every position of a Tak.Game. The game is replayed once on a
+TakBitboard.BitBoard and a compact snapshot (see BitBoard.snapshot) is kept
+every interval plies; the turns, stored as TakMoves codes, are the deltas
+between them. A position is reached from the current one by applying or
+undoing turns, or from the closest earlier checkpoint, so any lookup costs at
+most interval applies and memory grows with plies / interval snapshots.
+
+    replay = Replay(game, interval=16)
+    board = replay.positionAt(40)
+    replay.back()
+    for board in replay:
+        ...
+
+Replay is a TakSearch.Position, so toMove, moves, outcome and the reserves
+(flats, caps) follow the current ply. The board returned is the replay's own
+and changes with the next step, use board.toBoard() or board.snapshot() to
+keep a position.
+"""
+
+INTERVAL = 16
+
+
+class Replay(Position):
+    """Replay of a Tak.Game with checkpoints every interval plies
+    """
+
+    def __init__(self, game, interval=INTERVAL):
+        if interval < 1:
+            raise ValueError("Checkpoint interval has to be at least 1")
+
+        self.game     = game
+        self.interval = interval
+        self.codes    = [fromTurn(turn) for turn in game.turns]
+        self.plies    = len(self.codes)
+
+        numFlats, numCaps = startingReserves(game.size)
+        self.setState(BitBoard(game.size), {color: numFlats for color in COLORS}, {color: numCaps for color in COLORS}, 0)
+
+        # checkpoint n holds the position at ply n * interval
+        self.checkpoints = []
+        for ply in range(self.plies+1):
+            if ply % interval == 0:
+                self.checkpoints.append(self.checkpoint())
+            if ply < self.plies:
+                self.step(self.codes[ply])
+
+        self.restore(0)
+
+    def checkpoint(self):
+        return self.board.snapshot(), dict(self.flats), dict(self.caps)
+
+    def restore(self, number):
+        snapshot, flats, caps = self.checkpoints[number]
+        self.board.restore(snapshot)
+        self.setState(self.board, dict(flats), dict(caps), number*self.interval)
+
+    def step(self, move):
+        # Undo records are only kept back to one interval, older positions come from checkpoints
+        self.make(move)
+        if len(self.line) > self.interval:
+            del self.line[0]
+
+    # Access
+
+    def positionAt(self, ply):
+        """Returns the board at ply, 0 being the empty board and len(game.turns)
+        the final position
+        """
+        if ply < 0 or ply > self.plies:
+            raise IndexError("Ply {} is outside of 0 to {}".format(ply, self.plies))
+
+        if ply < self.ply and self.ply - ply <= len(self.line):
+            while self.ply > ply:
+                self.unmake(*self.line[-1])
+            return self.board
+
+        # Replay from the closest checkpoint unless the target is ahead within reach
+        number = ply // self.interval
+        if ply < self.ply or number*self.interval > self.ply:
+            self.restore(number)
+        while self.ply < ply:
+            self.step(self.codes[self.ply])
+        return self.board
+
+    position_at = positionAt
+
+    def forward(self):
+        """Steps to the next position, returns its board or None at the end of the game
+        """
+        if self.ply >= self.plies:
+            return None
+        return self.positionAt(self.ply+1)
+
+    def back(self):
+        """Steps to the previous position, returns its board or None at the start
+        """
+        if self.ply <= 0:
+            return None
+        return self.positionAt(self.ply-1)
+
+    def turnAt(self, ply):
+        """Tak.Turn played from the position at ply
+        """
+        return toTurn(self.codes[ply])
+
+    def __len__(self):
+        return self.plies+1
+
+    def __iter__(self):
+        """Yields the board of every position in order, starting with the empty board
+        """
+        yield self.positionAt(0)
+        while self.ply < self.plies:
+            yield self.forward()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Show positions of a ptn game')
+    parser.add_argument('path', help='ptn file')
+    parser.add_argument('plies', type=int, nargs='*', help='plies to show, all of them if left out')
+    parser.add_argument('--interval', type=int, default=INTERVAL, help='plies between checkpoints')
+    args = parser.parse_args(argv)
+
+    replay = Replay(TakReader.readGame(args.path), args.interval)
+    plies = args.plies or range(len(replay))
+    for ply in plies:
+        board = replay.positionAt(ply)
+        print("Ply {}{}".format(ply, " - " + replay.turnAt(ply-1).ptn() if ply else ""))
+        print(board)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,243 @@
+"""
+TakRoads
+
+Incremental road detection. RoadTracker keeps the connected components of
+road squares (squares topped by a flat or cap) for each color in a
+union-find structure. Each component root carries flags for the board edges
+the component touches, so asking whether a color has a road is O(1). Every update returns a journal
+so the board can revert it when a move is undone.
+
+Squares are indexed as row * size + fil, colors are Tak.COLORS values.
+"""
+
+# Edge flags carried by component roots
+NORTH = 1
+SOUTH = 2
+EAST  = 4
+WEST  = 8
+
+# Journal entry kinds, see RoadTracker.revert
+OWNER   = 0
+ADD     = 1
+UNION   = 2
+SPLIT   = 3
+
+
+def spans(flags):
+    """Checks if a set of edge flags connects two opposite sides
+    """
+    return (flags & (NORTH | SOUTH)) == (NORTH | SOUTH) or (flags & (EAST | WEST)) == (EAST | WEST)
+
+
+class RoadTracker(object):
+    """Union-find over the road squares of both colors, updated as stones move
+    """
+
+    def __init__(self, size):
+        self.size = size
+        squares = size*size
+
+        # Owner of the road at each square, None for empty squares and walls
+        self.owner = [None] * squares
+
+        # Per color union-find, indexed by color.value
+        self.parent = [[-1] * squares, [-1] * squares]
+        self.weight = [[0] * squares, [0] * squares]
+        self.flags  = [[0] * squares, [0] * squares]
+
+        # Number of components spanning the board, per color
+        self.roadCount = [0, 0]
+
+        self.edges = []
+        self.neighbours = []
+        for row in range(size):
+            for fil in range(size):
+                edge = 0
+                if row == size-1:
+                    edge |= NORTH
+                if row == 0:
+                    edge |= SOUTH
+                if fil == size-1:
+                    edge |= EAST
+                if fil == 0:
+                    edge |= WEST
+                self.edges.append(edge)
+
+                neighbours = []
+                if row < size-1:
+                    neighbours.append((row+1)*size + fil)
+                if row > 0:
+                    neighbours.append((row-1)*size + fil)
+                if fil < size-1:
+                    neighbours.append(row*size + fil+1)
+                if fil > 0:
+                    neighbours.append(row*size + fil-1)
+                self.neighbours.append(tuple(neighbours))
+
+    def hasRoad(self, color):
+        return self.roadCount[color.value] > 0
+
+    def find(self, value, index):
+        # No path compression, union by weight keeps trees shallow on Tak boards
+        parent = self.parent[value]
+        while parent[index] != index:
+            index = parent[index]
+        return index
+
+    def union(self, value, a, b, journal=None):
+        rootA = self.find(value, a)
+        rootB = self.find(value, b)
+        if rootA == rootB:
+            return
+
+        parent = self.parent[value]
+        weight = self.weight[value]
+        flags  = self.flags[value]
+
+        if weight[rootA] < weight[rootB]:
+            rootA, rootB = rootB, rootA
+
+        if journal is not None:
+            journal.append((UNION, value, rootB, rootA, weight[rootA], flags[rootA], self.roadCount[value]))
+
+        before = spans(flags[rootA]) + spans(flags[rootB])
+
+        parent[rootB] = rootA
+        weight[rootA] += weight[rootB]
+        flags[rootA] |= flags[rootB]
+
+        self.roadCount[value] += spans(flags[rootA]) - before
+
+    def add(self, value, index, journal=None):
+        if journal is not None:
+            journal.append((ADD, value, index, self.roadCount[value]))
+
+        self.parent[value][index] = index
+        self.weight[value][index] = 1
+        self.flags[value][index] = self.edges[index]
+        if spans(self.edges[index]):
+            self.roadCount[value] += 1
+
+        # Squares of this color not yet added are skipped, they join when added
+        parent = self.parent[value]
+        for neighbour in self.neighbours[index]:
+            if parent[neighbour] != -1:
+                self.union(value, index, neighbour, journal)
+
+    def rebuild(self, value):
+        """Recomputes the components of one color from the owner list
+        """
+        parent = self.parent[value]
+        for index in range(len(parent)):
+            parent[index] = -1
+        self.roadCount[value] = 0
+
+        for index, owner in enumerate(self.owner):
+            if owner is not None and owner.value == value:
+                self.add(value, index)
+
+    def split(self, value, lost, journal=None):
+        """Recomputes the components that held the squares a color lost.
+        Union-find can't split a component, so the squares of those components
+        are taken out and the ones the color still owns are added back. Other
+        components are left alone.
+        """
+        parent = self.parent[value]
+        weight = self.weight[value]
+        flags  = self.flags[value]
+        neighbours = self.neighbours
+
+        # Adjacent squares in the union-find always share a component, so the
+        # components are the squares reachable from the lost ones
+        members = list(lost)
+        seen = set(lost)
+        for index in members:
+            for neighbour in neighbours[index]:
+                if neighbour not in seen and parent[neighbour] != -1:
+                    seen.add(neighbour)
+                    members.append(neighbour)
+
+        if journal is not None:
+            journal.append((SPLIT, value, [(index, parent[index], weight[index], flags[index]) for index in members], self.roadCount[value]))
+
+        for index in members:
+            if parent[index] == index and spans(flags[index]):
+                self.roadCount[value] -= 1
+        for index in members:
+            parent[index] = -1
+
+        for index in members:
+            owner = self.owner[index]
+            if owner is not None and owner.value == value:
+                self.add(value, index)
+
+    def update(self, changes):
+        """Applies a list of (index, owner) pairs, owner being a color or None.
+        Returns a journal that revert uses to restore the previous state.
+        """
+        journal = []
+        lost = None
+        gained = []
+
+        for index, owner in changes:
+            old = self.owner[index]
+            if old == owner:
+                continue
+
+            journal.append((OWNER, index, old))
+            self.owner[index] = owner
+            if old is not None:
+                if lost is None:
+                    lost = ([], [])
+                lost[old.value].append(index)
+            if owner is not None:
+                gained.append(index)
+
+        if lost is not None:
+            for value in (0, 1):
+                if lost[value]:
+                    self.split(value, lost[value], journal)
+
+        for index in gained:
+            self.add(self.owner[index].value, index, journal)
+
+        return journal
+
+    def revert(self, journal):
+        """Undoes an update, given the journal it returned.
+        Journals have to be reverted in the reverse order of their updates.
+        """
+        for entry in reversed(journal):
+            kind = entry[0]
+            if kind == OWNER:
+                self.owner[entry[1]] = entry[2]
+
+            elif kind == ADD:
+                value = entry[1]
+                self.parent[value][entry[2]] = -1
+                self.roadCount[value] = entry[3]
+
+            elif kind == UNION:
+                value, rootB, rootA = entry[1], entry[2], entry[3]
+                self.parent[value][rootB] = rootB
+                self.weight[value][rootA] = entry[4]
+                self.flags[value][rootA] = entry[5]
+                self.roadCount[value] = entry[6]
+
+            else:
+                value = entry[1]
+                parent = self.parent[value]
+                weight = self.weight[value]
+                flags  = self.flags[value]
+                for index, oldParent, oldWeight, oldFlags in entry[2]:
+                    parent[index] = oldParent
+                    weight[index] = oldWeight
+                    flags[index] = oldFlags
+                self.roadCount[value] = entry[3]
+
+    def reset(self, owners):
+        """Replaces every owner at once, owners is a list indexed by square
+        """
+        self.owner = list(owners)
+        self.rebuild(0)
+        self.rebuild(1)
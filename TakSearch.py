@@ -0,0 +1,415 @@
+import sys
+import time
+import argparse
+
+from Tak import COLORS, PIECES, STATES, gameResult
+from TakMoves import generateMoves, toTurn, isStackMove, moveColor, movePiece
+from TakZobrist import TranspositionTable, REPLACEMENT
+import TakReader
+
+"""
+TakSearch
+
+Alpha-beta search engine. Negamax with iterative deepening over the TakMoves
+generator, using Board.apply / Board.undo to explore in place,
+Tak.gameResult to detect the end of the game (so a Tak.Board or a
+TakBitboard.BitBoard can be searched), and a transposition table keyed by
+the board's Zobrist hash.
+
+Evaluation functions are pluggable: any function evaluate(board, color)
+returning a score for color, the side to move, can be passed to Searcher.
+"""
+
+WIN = 1000000
+
+# Scores closer to WIN than this are wins at a known distance
+WIN_BOUND = WIN - 1000
+
+# Transposition table entry bounds
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+
+class SearchAbort(Exception):
+    """Raised inside the search when the node or time budget runs out
+    """
+    pass
+
+
+def opponent(color):
+    if color == COLORS.white:
+        return COLORS.black
+    return COLORS.white
+
+
+# ====================================================
+#                    Evaluation
+# ====================================================
+
+PIECE_VALUES = {
+    PIECES.flat : 100,
+    PIECES.wall : 50,
+    PIECES.cap  : 80,
+}
+
+def flatEvaluation(board, color):
+    """Default evaluation: material on top of stacks, stones held in
+    controlled stacks and a small bonus for central squares.
+    """
+    colors, pieces, heights = board.tops()
+    size = board.size
+    center = (size-1) / 2
+
+    score = 0
+    for index, owner in enumerate(colors):
+        if owner is None:
+            continue
+
+        row, fil = divmod(index, size)
+        value = PIECE_VALUES[pieces[index]] + 10*(heights[index]-1)
+        value += int(4*(center - max(abs(row-center), abs(fil-center))))
+
+        if owner == color:
+            score += value
+        else:
+            score -= value
+
+    return score
+
+
+# ====================================================
+#                      Search
+# ====================================================
+
+class SearchResult(object):
+
+    def __init__(self, bestMove, pv, score, depth, nodes, seconds):
+        self.bestMove = bestMove    # Tak.Turn
+        self.pv       = pv          # list of Tak.Turn
+        self.score    = score       # for the side to move
+        self.depth    = depth       # last completed depth
+        self.nodes    = nodes
+        self.seconds  = seconds
+
+    def nps(self):
+        if self.seconds <= 0:
+            return 0
+        return int(self.nodes / self.seconds)
+
+    def __str__(self):
+        return "depth {} score {} nodes {} nps {} pv {}".format(
+            self.depth,
+            self.score,
+            self.nodes,
+            self.nps(),
+            ' '.join(turn.ptn() for turn in self.pv)
+        )
+
+
+class Position(object):
+    """Playable position over a board: side to move, reserves and in place
+    make / unmake of TakMoves codes. Shared by the search engines.
+    """
+
+    def setup(self, game):
+        flats = {color: game.players[color].flats for color in COLORS}
+        caps  = {color: game.players[color].caps for color in COLORS}
+        self.setState(game.board, flats, caps, len(game.turns))
+
+    def setState(self, board, flats, caps, ply):
+        self.board = board
+        self.size  = board.size
+        self.ply   = ply
+        self.flats = flats
+        self.caps  = caps
+
+        # Moves made since setup, so they can be unwound
+        self.line = []
+
+    def state(self):
+        return self.board, dict(self.flats), dict(self.caps), self.ply
+
+    def toMove(self):
+        if self.ply % 2 == 0:
+            return COLORS.white
+        return COLORS.black
+
+    def moves(self):
+        color = self.toMove()
+        firstTurn = self.ply < 2
+        if firstTurn:
+            # First turn of each player places the opponent's stone
+            color = opponent(color)
+        return list(generateMoves(self.board, color, self.flats[color], self.caps[color], firstTurn))
+
+    def make(self, move):
+        if not isStackMove(move):
+            if movePiece(move) == PIECES.cap:
+                self.caps[moveColor(move)] -= 1
+            else:
+                self.flats[moveColor(move)] -= 1
+        self.ply += 1
+        record = self.board.apply(toTurn(move))
+        self.line.append((move, record))
+        return record
+
+    def unmake(self, move, record):
+        self.line.pop()
+        self.board.undo(record)
+        self.ply -= 1
+        if not isStackMove(move):
+            if movePiece(move) == PIECES.cap:
+                self.caps[moveColor(move)] += 1
+            else:
+                self.flats[moveColor(move)] += 1
+
+    def unwind(self):
+        """Unmakes every move made since setup
+        """
+        while self.line:
+            self.unmake(*self.line[-1])
+
+    def outcome(self, mover):
+        """Returns None while the game goes on, otherwise the winning color,
+        or False for a draw. Checked right after mover has moved.
+        """
+        exhausted = any(self.flats[color] + self.caps[color] == 0 for color in COLORS)
+        state, winner, win = gameResult(self.board, mover, exhausted)
+        if state == STATES.playing:
+            return None
+        if state == STATES.draw:
+            return False
+        return winner
+
+    def flatWinner(self):
+        """Winner by flat count, False on a tie
+        """
+        flats = self.board.flatCounts()
+        if flats[COLORS.white] == flats[COLORS.black]:
+            return False
+        if flats[COLORS.white] > flats[COLORS.black]:
+            return COLORS.white
+        return COLORS.black
+
+
+class Searcher(Position):
+    """Iterative deepening negamax alpha-beta search.
+    Budgets: maxDepth in plies, nodeLimit in visited nodes and timeLimit in
+    seconds. When a budget runs out the result of the last completed depth is
+    returned.
+    """
+
+    def __init__(self, evaluate=flatEvaluation, table=None, maxDepth=4, nodeLimit=None, timeLimit=None):
+        self.evaluate  = evaluate
+        self.table     = table if table is not None else TranspositionTable(1 << 18, REPLACEMENT.depth)
+        self.maxDepth  = maxDepth
+        self.nodeLimit = nodeLimit
+        self.timeLimit = timeLimit
+
+    # Budget
+
+    def checkBudget(self):
+        if self.nodeLimit is not None and self.nodes >= self.nodeLimit:
+            raise SearchAbort()
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise SearchAbort()
+
+    # Move ordering
+
+    def order(self, moves, ttMove, ply):
+        killers = self.killers[ply] if ply < len(self.killers) else ()
+        history = self.history
+
+        def key(move):
+            if move == ttMove:
+                return -3000000
+            if move in killers:
+                return -2000000
+            return -history.get(move, 0)
+
+        moves.sort(key=key)
+        return moves
+
+    # Search
+
+    def negamax(self, depth, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self.checkBudget()
+
+        key = self.board.hash
+        alphaStart = alpha
+        ttMove = None
+
+        entry = self.table.lookup(key)
+        if entry is not None:
+            entryDepth, entryScore, entryFlag, ttMove = entry
+            if entryDepth >= depth:
+                entryScore = fromTable(entryScore, ply)
+                if entryFlag == EXACT:
+                    return entryScore
+                elif entryFlag == LOWER:
+                    alpha = max(alpha, entryScore)
+                else:
+                    beta = min(beta, entryScore)
+                if alpha >= beta:
+                    return entryScore
+
+        mover = self.toMove()
+        if depth == 0:
+            return self.evaluate(self.board, mover)
+
+        moves = self.moves()
+        if not moves:
+            return 0
+
+        self.order(moves, ttMove, ply)
+
+        best = -WIN-1
+        bestMove = None
+        for move in moves:
+            record = self.make(move)
+            result = self.outcome(mover)
+            if result is None:
+                score = -self.negamax(depth-1, -beta, -alpha, ply+1)
+            elif result is False:
+                score = 0
+            elif result == mover:
+                score = WIN - ply
+            else:
+                score = -(WIN - ply)
+            self.unmake(move, record)
+
+            if score > best:
+                best = score
+                bestMove = move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                self.addKiller(move, ply)
+                self.history[move] = self.history.get(move, 0) + depth*depth
+                break
+
+        if best <= alphaStart:
+            flag = UPPER
+        elif best >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.table.store(key, (depth, toTable(best, ply), flag, bestMove), depth)
+
+        return best
+
+    def addKiller(self, move, ply):
+        while len(self.killers) <= ply:
+            self.killers.append([])
+        killers = self.killers[ply]
+        if move not in killers:
+            killers.insert(0, move)
+            del killers[2:]
+
+    def principalVariation(self, depth):
+        """Follows best moves stored in the table from the current position
+        """
+        pv = []
+        records = []
+        for ply in range(depth):
+            entry = self.table.lookup(self.board.hash)
+            if entry is None or entry[3] is None:
+                break
+            move = entry[3]
+            if move not in self.moves():
+                break
+
+            mover = self.toMove()
+            pv.append(move)
+            records.append((move, self.make(move)))
+            if self.outcome(mover) is not None:
+                break
+
+        for move, record in reversed(records):
+            self.unmake(move, record)
+        return pv
+
+    def search(self, game):
+        """Searches the position of a Tak.Game, returns a SearchResult.
+        The game's board is used in place and restored before returning.
+        """
+        self.setup(game)
+        self.nodes = 0
+        self.killers = []
+        self.history = {}
+
+        start = time.perf_counter()
+        self.deadline = start + self.timeLimit if self.timeLimit is not None else None
+
+        result = SearchResult(None, [], 0, 0, 0, 0)
+        for depth in range(1, self.maxDepth+1):
+            try:
+                score = self.negamax(depth, -WIN-1, WIN+1, 0)
+            except SearchAbort:
+                # Restore the board and keep the last complete depth
+                self.unwind()
+                break
+
+            pv = self.principalVariation(depth)
+            result = SearchResult(
+                toTurn(pv[0]) if pv else None,
+                [toTurn(move) for move in pv],
+                score,
+                depth,
+                self.nodes,
+                time.perf_counter() - start
+            )
+
+            # A forced result was found, deeper searches can't change it
+            if abs(score) >= WIN_BOUND:
+                break
+
+        result.nodes = self.nodes
+        result.seconds = time.perf_counter() - start
+        return result
+
+
+def toTable(score, ply):
+    # Win scores are stored relative to the node so they stay valid at other plies
+    if score >= WIN_BOUND:
+        return score + ply
+    if score <= -WIN_BOUND:
+        return score - ply
+    return score
+
+
+def fromTable(score, ply):
+    if score >= WIN_BOUND:
+        return score - ply
+    if score <= -WIN_BOUND:
+        return score + ply
+    return score
+
+
+def search(game, maxDepth=4, nodeLimit=None, timeLimit=None, evaluate=flatEvaluation):
+    """Convenience wrapper, returns the SearchResult for the side to move
+    """
+    searcher = Searcher(evaluate=evaluate, maxDepth=maxDepth, nodeLimit=nodeLimit, timeLimit=timeLimit)
+    return searcher.search(game)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Alpha-beta search on a ptn game')
+    parser.add_argument('path', help='ptn file, the position after its last move is searched')
+    parser.add_argument('--depth', type=int, default=4, help='maximum depth in plies')
+    parser.add_argument('--nodes', type=int, default=None, help='node budget')
+    parser.add_argument('--seconds', type=float, default=None, help='time budget')
+    args = parser.parse_args(argv)
+
+    game = TakReader.readGame(args.path)
+    result = search(game, maxDepth=args.depth, nodeLimit=args.nodes, timeLimit=args.seconds)
+    print(game.board)
+    print(result)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
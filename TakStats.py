@@ -0,0 +1,170 @@
+import os
+import sys
+import json
+import atexit
+from time import perf_counter
+from contextlib import contextmanager
+
+"""
+TakStats
+
+Opt-in counters and timers for the hot paths of the library: ptn parsing,
+Board.apply, move generation and road checks. Collection is off by default,
+instrumented code then only tests STATS.enabled.
+
+    import TakStats
+    TakStats.enable()
+    ...
+    print(TakStats.summary())
+    TakStats.writeJson('stats.json')
+
+Setting the TAK_STATS environment variable enables collection at import and
+writes the summary to stderr at exit (or the JSON to a file when TAK_STATS is
+a path ending in .json), so batch runs can be profiled without code changes.
+
+Timers hold a call count and total seconds, counters a plain count. Stats are
+kept per process, work done by TakReader.parseGames workers is not included.
+
+Instrumented code times itself inline, so the disabled path costs one test:
+
+    start = perf_counter() if STATS.enabled else None
+    ...
+    if start is not None:
+        STATS.stop('apply', start)
+"""
+
+# Timer names used by the library
+PARSE   = 'parse'
+APPLY   = 'apply'
+MOVEGEN = 'movegen'
+ROADS   = 'roads'
+
+
+class Stats(object):
+    """Counters and timers of one process
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.counters = {}
+        self.timers   = {}      # name -> [calls, seconds]
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def add(self, name, seconds, calls=1):
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = [0, 0.0]
+        timer[0] += calls
+        timer[1] += seconds
+
+    def stop(self, name, start):
+        """Adds the time since start, a perf_counter value, to a timer
+        """
+        self.add(name, perf_counter() - start)
+
+    @contextmanager
+    def timer(self, name):
+        """Times a block, does nothing while disabled
+        """
+        if not self.enabled:
+            yield
+            return
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.stop(name, start)
+
+    def timedIterator(self, name, iterator, counter=None):
+        """Yields from iterator, timing only the time spent producing items.
+        counter, if given, counts the items.
+        """
+        iterator = iter(iterator)
+        seconds = 0.0
+        items = 0
+        try:
+            while True:
+                start = perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    seconds += perf_counter() - start
+                items += 1
+                yield item
+        finally:
+            self.add(name, seconds)
+            if counter is not None:
+                self.count(counter, items)
+
+    def snapshot(self):
+        """Returns the stats as a dict of plain values
+        """
+        return {
+            'counters': dict(self.counters),
+            'timers': {
+                name: {
+                    'calls'   : calls,
+                    'seconds' : seconds,
+                    'perCall' : seconds / calls if calls else 0.0,
+                }
+                for name, (calls, seconds) in self.timers.items()
+            },
+        }
+
+    def summary(self):
+        lines = []
+        for name in sorted(self.timers):
+            calls, seconds = self.timers[name]
+            perCall = seconds / calls * 1e6 if calls else 0.0
+            lines.append("{:12} {:>12} calls {:>10.3f}s {:>10.2f}us/call".format(name, calls, seconds, perCall))
+        for name in sorted(self.counters):
+            lines.append("{:12} {:>12}".format(name, self.counters[name]))
+        return "\n".join(lines)
+
+    def toJson(self, **kwargs):
+        return json.dumps(self.snapshot(), **kwargs)
+
+
+STATS = Stats()
+
+
+def enable():
+    STATS.enabled = True
+
+def disable():
+    STATS.enabled = False
+
+def reset():
+    STATS.reset()
+
+def snapshot():
+    return STATS.snapshot()
+
+def summary():
+    return STATS.summary()
+
+def toJson(**kwargs):
+    return STATS.toJson(**kwargs)
+
+def writeJson(filepath):
+    with open(filepath, 'w') as file:
+        file.write(STATS.toJson(indent=2))
+
+
+def _report(target):
+    if target.endswith('.json'):
+        writeJson(target)
+    else:
+        sys.stderr.write(summary() + "\n")
+
+
+if os.environ.get('TAK_STATS'):
+    enable()
+    atexit.register(_report, os.environ['TAK_STATS'])
@@ -0,0 +1,235 @@
+from enum import Enum
+
+from Tak import DIRECTIONS, Board, Turn, getDirectionMods, getSpace, getSpaces
+from TakMoves import isStackMove, moveRow, moveFil, moveColor, movePiece, moveDirection, moveDrops, placement, stackMove
+from TakZobrist import KINDS, getKeys
+
+"""
+TakSymmetry
+
+The 8 symmetries of the square board (rotations and mirrors) applied to
+boards, squares, directions, turns and TakMoves codes, and a canonical form so
+caches and indexes can store one entry for all 8 orientations of a position.
+
+A transform is built from three steps, applied in order to (row, fil):
+
+    swap      exchange row and fil
+    flip rows row becomes size-1-row
+    flip fils fil becomes size-1-fil
+
+TRANSFORMS values hold these as bits (swap 4, flip rows 2, flip fils 1).
+
+canonical(board) returns the orientation with the lowest Zobrist hash and the
+transform leading to it, so symmetric positions share one canonical hash. A
+move found in the canonical orientation is brought back with
+transformTurn(turn, inverse(transform), size).
+"""
+
+SWAP     = 4
+FLIP_ROW = 2
+FLIP_FIL = 1
+
+
+class TRANSFORMS(Enum):
+    '''Symmetries of the square board
+    '''
+    identity      = 0
+    mirrorFiles   = FLIP_FIL
+    mirrorRows    = FLIP_ROW
+    rotate180     = FLIP_ROW | FLIP_FIL
+    transpose     = SWAP
+    rotate90      = SWAP | FLIP_FIL
+    rotate270     = SWAP | FLIP_ROW
+    antiTranspose = SWAP | FLIP_ROW | FLIP_FIL
+
+
+# ====================================================
+#                 Squares and Directions
+# ====================================================
+
+def transformSquare(row, fil, transform, size):
+    """Returns the (row, fil) a square moves to
+    """
+    bits = transform.value
+    if bits & SWAP:
+        row, fil = fil, row
+    if bits & FLIP_ROW:
+        row = size-1 - row
+    if bits & FLIP_FIL:
+        fil = size-1 - fil
+    return row, fil
+
+
+def transformSpace(space, transform, size):
+    return getSpace(*transformSquare(space.row, space.fil, transform, size))
+
+
+# Direction of every (row, fil) step, callers unpack getDirectionMods as (rowMod, filMod)
+_STEPS = {getDirectionMods(direction): direction for direction in DIRECTIONS}
+
+def transformDirection(direction, transform):
+    """Returns the direction a stack move takes after the transform
+    """
+    rowMod, filMod = getDirectionMods(direction)
+    bits = transform.value
+    if bits & SWAP:
+        rowMod, filMod = filMod, rowMod
+    if bits & FLIP_ROW:
+        rowMod = -rowMod
+    if bits & FLIP_FIL:
+        filMod = -filMod
+    return _STEPS[(rowMod, filMod)]
+
+
+def _buildTables():
+    # Found by applying the transforms to a board with distinct squares
+    size = 3
+    squares = lambda transform: [transformSquare(row, fil, transform, size) for row in range(size) for fil in range(size)]
+    images = {tuple(squares(transform)): transform for transform in TRANSFORMS}
+
+    inverses = {}
+    compositions = {}
+    for first in TRANSFORMS:
+        for second in TRANSFORMS:
+            image = tuple(transformSquare(*transformSquare(row, fil, first, size), second, size) for row in range(size) for fil in range(size))
+            compositions[(first, second)] = images[image]
+            if images[image] == TRANSFORMS.identity:
+                inverses[first] = second
+    return inverses, compositions
+
+_INVERSES, _COMPOSITIONS = _buildTables()
+
+
+def inverse(transform):
+    """Returns the transform undoing transform
+    """
+    return _INVERSES[transform]
+
+
+def compose(first, second):
+    """Returns the transform applying first, then second
+    """
+    return _COMPOSITIONS[(first, second)]
+
+
+# ====================================================
+#                    Turns and Moves
+# ====================================================
+
+def transformTurn(turn, transform, size):
+    """Returns a new Tak.Turn, the turn as played on the transformed board
+    """
+    space = transformSpace(turn.space, transform, size)
+    if turn.isMove:
+        return Turn(turn.color, space, isMove=True, direction=transformDirection(turn.direction, transform), drops=turn.drops)
+    return Turn(turn.color, space, piece=turn.piece)
+
+
+def transformMove(move, transform, size):
+    """transformTurn for a TakMoves code
+    """
+    row, fil = transformSquare(moveRow(move), moveFil(move), transform, size)
+    if isStackMove(move):
+        return stackMove(row, fil, moveColor(move), transformDirection(moveDirection(move), transform), moveDrops(move))
+    return placement(row, fil, moveColor(move), movePiece(move))
+
+
+# ====================================================
+#                        Boards
+# ====================================================
+
+_PERMUTATIONS = {}
+
+def squarePermutation(transform, size):
+    """Returns a list mapping every square index (row * size + fil) to its
+    index after the transform. Lists are built once per size and shared.
+    """
+    key = (transform, size)
+    if key not in _PERMUTATIONS:
+        permutation = []
+        for row in range(size):
+            for fil in range(size):
+                newRow, newFil = transformSquare(row, fil, transform, size)
+                permutation.append(newRow*size + newFil)
+        _PERMUTATIONS[key] = permutation
+    return _PERMUTATIONS[key]
+
+
+def boardStacks(board):
+    """Yields (index, stones) for every occupied square of a Tak.Board or BitBoard
+    """
+    for index, space in enumerate(getSpaces(board.size)):
+        stones = board.getStack(space).stones
+        if stones:
+            yield index, stones
+
+
+def sideKey(board):
+    """The side to move part of a board hash: 0 with white to move, the side key otherwise
+    """
+    keys = getKeys(board.size)
+    output = board.hash
+    for index, stones in boardStacks(board):
+        for height, stone in enumerate(stones):
+            output ^= keys.stone(index, height, stone.color, stone.piece)
+    return output
+
+
+def transformBoard(board, transform):
+    """Returns a new Tak.Board holding the transformed position, hash included
+    """
+    size = board.size
+    permutation = squarePermutation(transform, size)
+    output = Board(size)
+    for index, stones in boardStacks(board):
+        row, fil = divmod(permutation[index], size)
+        output.grid[row][fil].place(list(stones))
+
+    side = sideKey(board)
+    output.refresh()
+    output.hash ^= side
+    return output
+
+
+def transformHashes(board):
+    """Returns the Zobrist hash of the board in each of the 8 orientations,
+    as a dict keyed by transform. One pass over the stones computes them all.
+    """
+    size = board.size
+    keys = getKeys(size)
+    permutations = [(transform, squarePermutation(transform, size)) for transform in TRANSFORMS]
+
+    hashes = {transform: 0 for transform in TRANSFORMS}
+    for index, stones in boardStacks(board):
+        for height, stone in enumerate(stones):
+            kind = stone.color.value*3 + stone.piece.value
+            for transform, permutation in permutations:
+                hashes[transform] ^= keys.stones[(permutation[index]*keys.maxHeight + height)*KINDS + kind]
+
+    # The identity hash without the side key tells which side is to move
+    side = board.hash ^ hashes[TRANSFORMS.identity]
+    for transform in TRANSFORMS:
+        hashes[transform] ^= side
+    return hashes
+
+
+def canonical(board):
+    """Returns (canonical hash, transform): the lowest hash over the 8
+    orientations, and the transform taking board to that orientation.
+    """
+    hashes = transformHashes(board)
+    transform = min(TRANSFORMS, key=lambda transform: (hashes[transform], transform.value))
+    return hashes[transform], transform
+
+
+def canonicalHash(board):
+    """Hash shared by all 8 orientations of a position
+    """
+    return canonical(board)[0]
+
+
+def canonicalBoard(board):
+    """Returns (canonical Tak.Board, transform), see canonical
+    """
+    key, transform = canonical(board)
+    return transformBoard(board, transform), transform
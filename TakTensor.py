@@ -0,0 +1,204 @@
+import numpy as np
+
+from Tak import COLORS, PIECES
+from TakBitboard import BitBoard
+
+"""
+TakTensor
+
+Exports board positions as fixed shape NumPy tensors for model training and
+bulk statistics. A position becomes an array of shape (planes, size, size):
+
+    2 * depth   white / black stone at each height, counted down from the top
+                of the stack, for the top depth stones
+    3           top piece is a flat / wall / cap
+    1           stack height
+    4           reserves: white flats, white caps, black flats, black caps
+    1           side to move, 1 when black is to move
+
+Boards are first reduced to a few integers per square (see squareArrays and,
+for batches of Tak.Boards, gridArrays), the planes for a whole batch are then
+built with vectorized NumPy operations into one preallocated array.
+"""
+
+DEPTH = 8
+
+# Offsets of the planes that follow the stone planes
+TOP_PLANES     = 0
+HEIGHT_PLANE   = 3
+RESERVE_PLANES = 4
+SIDE_PLANE     = 8
+EXTRA_PLANES   = 9
+
+
+def planeCount(depth=DEPTH):
+    return 2*depth + EXTRA_PLANES
+
+
+def squareArrays(board, depth=DEPTH):
+    """Returns four sequences indexed by row * size + fil:
+    colors of the top depth stones as bits (bit 0 is the lowest of them, set
+    for black), number of those stones, full stack height and top piece value
+    (-1 for empty squares).
+    """
+    if not isinstance(board, BitBoard):
+        return [arrays[0] for arrays in gridArrays([board], depth)]
+
+    topBits    = []
+    topHeights = []
+    heights    = []
+    pieces     = []
+
+    colors, tops, stackHeights = board.tops()
+    for index, height in enumerate(stackHeights):
+        shown = min(height, depth)
+        topBits.append(board.stacks[index] >> (height - shown))
+        topHeights.append(shown)
+        heights.append(height)
+        pieces.append(tops[index].value if height else -1)
+    return topBits, topHeights, heights, pieces
+
+
+def gridArrays(boards, depth=DEPTH):
+    """squareArrays for a batch of Tak.Boards of one size, as arrays of shape
+    (count, size*size), read in one pass over all the boards. Tak.Stack packs
+    its colors like BitBoard stacks, so the shown stones are its top bits.
+    """
+    count = len(boards)
+    squares = boards[0].size**2 if boards else 0
+
+    stacks = [stack for board in boards for row in board.grid for stack in row]
+    heights = np.fromiter([stack.count for stack in stacks], np.int64, len(stacks))
+    topHeights = np.minimum(heights, depth)
+    topBits = np.fromiter([stack.bits >> max(stack.count - depth, 0) for stack in stacks], np.int64, len(stacks))
+
+    # Enum members compare by identity, object arrays compare them in C
+    tops = np.empty(len(stacks), dtype=object)
+    tops[:] = [stack.top for stack in stacks]
+    pieces = np.full(len(stacks), -1, dtype=np.int64)
+    for piece in PIECES:
+        pieces[tops == piece] = piece.value
+
+    shape = (count, squares)
+    return topBits.reshape(shape), topHeights.reshape(shape), heights.reshape(shape), pieces.reshape(shape)
+
+
+def allocate(count, size, depth=DEPTH, dtype=np.float32):
+    """Returns a zeroed batch array for count positions
+    """
+    return np.zeros((count, planeCount(depth), size, size), dtype=dtype)
+
+
+def fillPlanes(out, topBits, topHeights, heights, pieces, reserves, blackToMove, depth=DEPTH):
+    """Builds the planes of a batch in one go.
+    Square arrays have shape (count, size*size), reserves (count, 4) and
+    blackToMove (count,). out has shape (count, planes, size, size).
+    """
+    count, planes, size, size = out.shape
+    squares = size*size
+
+    # Planes are written through a flat view, so out has to be contiguous
+    if not out.flags.c_contiguous:
+        raise ValueError("out has to be a C contiguous array")
+    flat = out.reshape(count, planes, squares)
+
+    levels = np.arange(depth, dtype=np.int64)
+
+    # Height below the top of the shown stones for every level, negative when absent
+    shift = topHeights[:, :, None] - 1 - levels[None, None, :]
+    present = shift >= 0
+    black = (topBits[:, :, None] >> np.maximum(shift, 0)) & 1
+
+    flat[:, 0:2*depth:2, :] = (present & (black == 0)).transpose(0, 2, 1)
+    flat[:, 1:2*depth:2, :] = (present & (black == 1)).transpose(0, 2, 1)
+
+    extra = 2*depth
+    for piece in PIECES:
+        flat[:, extra + TOP_PLANES + piece.value, :] = pieces == piece.value
+    flat[:, extra + HEIGHT_PLANE, :] = heights
+    flat[:, extra + RESERVE_PLANES:extra + RESERVE_PLANES+4, :] = reserves[:, :, None]
+    flat[:, extra + SIDE_PLANE, :] = blackToMove[:, None]
+
+    return out
+
+
+def boardsToTensor(positions, size, depth=DEPTH, out=None, dtype=np.float32):
+    """Converts positions into one batch array.
+    positions is a sequence of (board, reserves, toMove) where reserves is
+    (white flats, white caps, black flats, black caps) and toMove a color.
+    If out is given it is filled in place and has to match the batch shape.
+    """
+    count = len(positions)
+    if out is None:
+        out = allocate(count, size, depth, dtype)
+
+    squares = size*size
+    topBits     = np.zeros((count, squares), dtype=np.int64)
+    topHeights  = np.zeros((count, squares), dtype=np.int64)
+    heights     = np.zeros((count, squares), dtype=np.int64)
+    pieces      = np.zeros((count, squares), dtype=np.int64)
+    reserves    = np.zeros((count, 4), dtype=np.int64)
+    blackToMove = np.zeros(count, dtype=np.int64)
+
+    grids = []
+    for number, (board, reserve, toMove) in enumerate(positions):
+        if isinstance(board, BitBoard):
+            topBits[number], topHeights[number], heights[number], pieces[number] = squareArrays(board, depth)
+        else:
+            grids.append(number)
+        reserves[number] = reserve
+        blackToMove[number] = toMove == COLORS.black
+
+    # Tak.Boards are converted together
+    if grids:
+        arrays = gridArrays([positions[number][0] for number in grids], depth)
+        for batch, array in zip((topBits, topHeights, heights, pieces), arrays):
+            batch[grids] = array
+
+    return fillPlanes(out, topBits, topHeights, heights, pieces, reserves, blackToMove, depth)
+
+
+def boardToTensor(board, reserves=(0, 0, 0, 0), toMove=COLORS.white, depth=DEPTH, dtype=np.float32):
+    """Converts a single board, returns an array of shape (planes, size, size)
+    """
+    return boardsToTensor([(board, reserves, toMove)], board.size, depth, dtype=dtype)[0]
+
+
+def gameToTensor(game, depth=DEPTH, out=None, dtype=np.float32):
+    """Converts every ply of a Tak.Game, including the empty starting board.
+    Returns an array of shape (len(game.turns)+1, planes, size, size).
+    """
+    size = game.size
+    plies = len(game.turns)
+    if out is None:
+        out = allocate(plies+1, size, depth, dtype)
+
+    # Starting reserves are what is left plus what was placed
+    reserves = {
+        color: [game.players[color].flats, game.players[color].caps]
+        for color in COLORS
+    }
+    for turn in game.turns:
+        if not turn.isMove:
+            reserves[turn.color][1 if turn.piece == PIECES.cap else 0] += 1
+
+    squares = size*size
+    topBits     = np.zeros((plies+1, squares), dtype=np.int64)
+    topHeights  = np.zeros((plies+1, squares), dtype=np.int64)
+    heights     = np.zeros((plies+1, squares), dtype=np.int64)
+    pieces      = np.zeros((plies+1, squares), dtype=np.int64)
+    reserveRows = np.zeros((plies+1, 4), dtype=np.int64)
+    blackToMove = np.arange(plies+1, dtype=np.int64) % 2
+
+    board = BitBoard(size)
+    for ply in range(plies+1):
+        if ply:
+            turn = game.turns[ply-1]
+            board.apply(turn)
+            if not turn.isMove:
+                reserves[turn.color][1 if turn.piece == PIECES.cap else 0] -= 1
+
+        topBits[ply], topHeights[ply], heights[ply], pieces[ply] = squareArrays(board, depth)
+        reserveRows[ply] = reserves[COLORS.white] + reserves[COLORS.black]
+
+    return fillPlanes(out, topBits, topHeights, heights, pieces, reserveRows, blackToMove, depth)
@@ -0,0 +1,350 @@
+import sys
+import time
+import random
+import argparse
+
+import Tak
+from Tak import COLORS, PIECES, getSpaces
+from TakMoves import toTurn
+from TakSearch import Position, opponent
+from TakWinSolver import blockMoves, winningMoves
+from TakZobrist import TranspositionTable, REPLACEMENT
+import TakReader
+
+"""
+TakTinue
+
+Tinue solver. Tinue is a forced road win: whatever the defender plays, the
+attacker (the side to move) completes a road within N of its own moves.
+
+The search is depth-first proof-number search (df-pn) over an AND/OR tree:
+
+    attacker nodes  the attacker's moves that win at once or make Tak (leave
+                    a road-completing move next turn). Quiet moves are not
+                    followed, as in the usual definition of tinue.
+    defender nodes  the defences from TakWinSolver.blockMoves. Any other move
+                    loses to a road, a defender road refutes the attack.
+
+Positions are played in place through TakSearch.Position, which also decides
+when a game has ended.
+
+Proof and disproof numbers are kept in a TakZobrist.TranspositionTable keyed
+by board hash and moves left, its capacity is the memory cap. A time cap ends
+the search with an unknown result.
+"""
+
+INF = 10**9
+
+# Keys mixed into the board hash for the number of attacker moves left
+_DEPTH_KEYS = [random.Random(7919 + moves).getrandbits(64) for moves in range(64)]
+
+
+class TinueAbort(Exception):
+    """Raised inside the search when the time cap runs out
+    """
+    pass
+
+
+class TinueResult(object):
+
+    def __init__(self, tinue, line, nodes, seconds):
+        self.tinue   = tinue        # True, False, or None when the caps ended the search
+        self.line    = line         # list of Tak.Turn: winning line or refutation
+        self.nodes   = nodes
+        self.seconds = seconds
+
+    def __str__(self):
+        if self.tinue is None:
+            status = "unknown"
+        elif self.tinue:
+            status = "tinue"
+        else:
+            status = "no tinue"
+        return "{} - {} nodes in {:.2f}s - {}".format(
+            status,
+            self.nodes,
+            self.seconds,
+            ' '.join(turn.ptn() for turn in self.line)
+        )
+
+
+def boardReserves(board):
+    """Returns (flats, caps) dicts of the stones each color has left after the
+    stones on board
+    """
+    startFlats, startCaps = Tak.startingReserves(board.size)
+    flats = {color: startFlats for color in COLORS}
+    caps  = {color: startCaps for color in COLORS}
+    for space in getSpaces(board.size):
+        for stone in board.getStack(space).stones:
+            if stone.piece == PIECES.cap:
+                caps[stone.color] -= 1
+            else:
+                flats[stone.color] -= 1
+    return flats, caps
+
+
+class TinueSolver(Position):
+    """df-pn search for tinue within maxMoves attacker moves.
+    memory is the transposition table capacity in entries, timeLimit is in seconds.
+    """
+
+    def __init__(self, maxMoves=3, memory=1 << 18, timeLimit=None):
+        self.maxMoves  = maxMoves
+        self.memory    = memory
+        self.timeLimit = timeLimit
+
+    # Tree
+
+    def roadMoves(self, color):
+        """Moves of color completing a road if color moved next. Only the side
+        to move can be on its first turn.
+        """
+        firstTurn = self.ply < 2 and color == self.toMove()
+        return winningMoves(self.board, color, self.flats[color], self.caps[color], firstTurn)
+
+    def attackerMoves(self, moves):
+        """Returns (proven, disproven, children) for the attacker to move with
+        moves left. Children are the moves making Tak.
+        """
+        attacker = self.attacker
+
+        # The defence may have ended the game, by filling the board or its reserve
+        outcome = self.outcome(opponent(attacker))
+        if outcome is not None:
+            return outcome == attacker, outcome != attacker, []
+
+        if self.roadMoves(attacker):
+            return True, False, []
+        if moves <= 1:
+            return False, True, []
+
+        children = []
+        for move in self.moves():
+            record = self.make(move)
+            if self.outcome(attacker) is None and self.roadMoves(attacker):
+                children.append(move)
+            self.unmake(move, record)
+
+        return False, not children, children
+
+    def defenderMoves(self):
+        """Returns (proven, disproven, children) for the defender to move.
+        Children are the defences, moves not listed lose to a road at once.
+        """
+        if self.roadMoves(opponent(self.attacker)):
+            return False, True, []
+
+        children = blockMoves(self.board, self.ply, self.flats, self.caps)
+        return not children, False, children
+
+    def key(self, moves):
+        return self.board.hash ^ _DEPTH_KEYS[moves]
+
+    def lookup(self, moves):
+        """Returns (pn, dn, children) of the current position, children is None
+        until the node has been expanded
+        """
+        entry = self.table.lookup(self.key(moves))
+        if entry is None:
+            return 1, 1, None
+        return entry
+
+    def store(self, moves, pn, dn, children):
+        # Settled entries are kept over ones still being searched
+        depth = 1 if pn == 0 or dn == 0 else 0
+        self.table.store(self.key(moves), (pn, dn, children), depth)
+
+    def childNumbers(self, children, childMoves):
+        """Proof and disproof numbers of each child, read from the table
+        """
+        output = []
+        for move in children:
+            record = self.make(move)
+            output.append(self.lookup(childMoves)[:2])
+            self.unmake(move, record)
+        return output
+
+    def mid(self, attackerToMove, moves, pnLimit, dnLimit):
+        """Searches the node at the current position until its proof or
+        disproof number reaches its limit. moves is the number of attacker
+        moves left, counting the attacker's move from this node if it is to move.
+        Returns the (pn, dn) of the node.
+        """
+        self.nodes += 1
+        # Nodes cost a move generation or more, the clock is cheap next to that
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise TinueAbort()
+
+        pn, dn, children = self.lookup(moves)
+        if pn == 0 or dn == 0:
+            return pn, dn
+
+        if children is None:
+            if attackerToMove:
+                proven, disproven, children = self.attackerMoves(moves)
+            else:
+                proven, disproven, children = self.defenderMoves()
+
+            if proven or disproven:
+                pn, dn = (0, INF) if proven else (INF, 0)
+                self.store(moves, pn, dn, children)
+                return pn, dn
+
+        childMoves = moves-1 if attackerToMove else moves
+
+        # Children are read from the table once, then kept up to date from
+        # the searches below so evicted entries don't stall the loop
+        numbers = self.childNumbers(children, childMoves)
+
+        while True:
+            # Attacker nodes need one proven child, defender nodes all of them
+            if attackerToMove:
+                pn = min(number[0] for number in numbers)
+                dn = min(INF, sum(number[1] for number in numbers))
+                order = sorted(range(len(numbers)), key=lambda n: numbers[n][0])
+            else:
+                pn = min(INF, sum(number[0] for number in numbers))
+                dn = min(number[1] for number in numbers)
+                order = sorted(range(len(numbers)), key=lambda n: numbers[n][1])
+
+            if pn >= pnLimit or dn >= dnLimit:
+                self.store(moves, pn, dn, children)
+                return pn, dn
+
+            best = order[0]
+            childPn, childDn = numbers[best]
+            if attackerToMove:
+                second = numbers[order[1]][0] if len(order) > 1 else INF
+                childPnLimit = min(pnLimit, second + 1)
+                childDnLimit = dnLimit - dn + childDn
+            else:
+                second = numbers[order[1]][1] if len(order) > 1 else INF
+                childPnLimit = pnLimit - pn + childPn
+                childDnLimit = min(dnLimit, second + 1)
+
+            move = children[best]
+            record = self.make(move)
+            try:
+                numbers[best] = self.mid(not attackerToMove, childMoves, childPnLimit, childDnLimit)
+            finally:
+                self.unmake(move, record)
+
+    # Lines
+
+    def solution(self, proven):
+        """Follows settled table entries from the root: attacker moves that
+        prove (or fail to) and defences that disprove (or resist longest).
+        Returns TakMoves codes.
+        """
+        output = []
+        attackerToMove = True
+        moves = self.maxMoves
+
+        while True:
+            if attackerToMove:
+                wins = self.roadMoves(self.attacker)
+                if wins:
+                    if proven:
+                        output.append(wins[0])
+                    break
+                done, failed, children = self.attackerMoves(moves)
+            else:
+                done, failed, children = self.defenderMoves()
+                if proven and not children:
+                    # No defence holds, any move shows the road that follows
+                    children = self.moves()[:1]
+            if not children:
+                break
+
+            childMoves = moves-1 if attackerToMove else moves
+            numbers = self.childNumbers(children, childMoves)
+
+            choice = None
+            if attackerToMove == proven:
+                # The side with the winning plan picks a settled child
+                for number, move in zip(numbers, children):
+                    if (number[0] == 0) if proven else (number[1] == 0):
+                        choice = move
+                        break
+            else:
+                # The other side resists with the child hardest to settle
+                index = max(range(len(numbers)), key=lambda n: numbers[n][0] if proven else numbers[n][1])
+                choice = children[index]
+
+            if choice is None:
+                break
+
+            output.append(choice)
+            self.make(choice)
+            attackerToMove = not attackerToMove
+            moves = childMoves
+
+        self.unwind()
+        return output
+
+    # Search
+
+    def solve(self, position, color=None, firstTurn=False):
+        """Decides if the side to move has tinue. position is a Tak.Game, or a
+        Tak.Board or BitBoard with color to move. For a bare board the
+        reserves are what its stones leave, and firstTurn tells if the move
+        is a player's first one. The board is used in place and restored.
+        Returns a TinueResult.
+        """
+        if isinstance(position, Tak.Game):
+            self.setup(position)
+        else:
+            flats, caps = boardReserves(position)
+            ply = 0 if firstTurn else 2
+            if color == COLORS.black:
+                ply += 1
+            self.setState(position, flats, caps, ply)
+
+        self.attacker = self.toMove()
+        self.table = TranspositionTable(self.memory, REPLACEMENT.depth)
+        self.nodes = 0
+
+        start = time.perf_counter()
+        self.deadline = start + self.timeLimit if self.timeLimit is not None else None
+
+        try:
+            pn, dn = self.mid(True, self.maxMoves, INF, INF)
+        except TinueAbort:
+            return TinueResult(None, [], self.nodes, time.perf_counter() - start)
+
+        tinue = None
+        line = []
+        if pn == 0:
+            tinue = True
+            line = self.solution(True)
+        elif dn == 0:
+            tinue = False
+            line = self.solution(False)
+
+        return TinueResult(tinue, [toTurn(move) for move in line], self.nodes, time.perf_counter() - start)
+
+
+def findTinue(position, maxMoves=3, color=None, memory=1 << 18, timeLimit=None, firstTurn=False):
+    """Convenience wrapper, see TinueSolver.solve
+    """
+    return TinueSolver(maxMoves, memory, timeLimit).solve(position, color, firstTurn)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Check a ptn game position for tinue')
+    parser.add_argument('path', help='ptn file, the position after its last move is solved')
+    parser.add_argument('--moves', type=int, default=3, help='attacker moves to win in')
+    parser.add_argument('--memory', type=int, default=1 << 18, help='table entries')
+    parser.add_argument('--seconds', type=float, default=None)
+    args = parser.parse_args(argv)
+
+    game = TakReader.readGame(args.path)
+    result = findTinue(game, args.moves, memory=args.memory, timeLimit=args.seconds)
+    print(game.board)
+    print(result)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,184 +1,468 @@
-import copy
-from Tak import COLORS, DIRECTIONS, PIECES, getDirectionMods, Turn, Space
+import logging
 
-class Group(object):
+from Tak import COLORS, DIRECTIONS, PIECES, Turn, getDirectionMods, getSpaces
+from TakDrops import dropPermutations, getDropTable
+from TakRoads import spans
+from TakMoves import gameMoves, generateMoves, toTurn, fromTurn, isStackMove, moveRow, moveFil, moveDirection, moveDrops
 
-    def __init__(self, color):
-        self.color  = color
-        self.stones = []
+logger = logging.getLogger(__name__)
 
 # ====================================================
 #                     Check Roads
 #
-# Includes functions for building groups and checking
-# groups for roads across the board
+# Road components are tracked incrementally by the
+# board (see TakRoads), so checking is a lookup
 # ====================================================
 
 def checkRoads(board):
-    """ Board of type Tak.Board
+    """ Board of type Tak.Board or BitBoard
     Returns {white:True, black:True}
     """
+    return board.roads()
 
-    # Find all groups, check for any that reach both sides
-    groups = []
-    used = []
 
-    size = board.size
+# ====================================================
+#                     Count Flats
+# ====================================================
 
-    for x in range(size):
-        for y in range(size):
+def countFlats(board):
+    #Returns object like: {white:5, black:7}
 
-            if board.grid[x][y].color and (x, y) not in used:
-                if board.grid[x][y].stones[-1].piece != PIECES.wall:
-                    # There is a piece at the coordinates (x,y)
-                    group = Group(board.grid[x][y].color)
+    # Both boards keep their counts up to date
+    output = board.flatCounts()
 
-                    buildGroup(board, group, (x, y))
+    logger.debug("countFlats output - %s", output)
+    return output
 
-                    groups.append(group)
-                    used += group.stones
+# ====================================================
+#                     Check for Tak
+# Tak is checked for both players having next move,
+# The response object has a key for each color with
+# the TAK status based on that color moving next.
+#
+# The method also returns a list of the moves which
+#  would complete a road win.
+# ====================================================
 
-                    # print( "Group Found - {} - {}".format(group.color.name, group.stones) )
+def newTakResult():
+    return {
+        COLORS.white: {
+            COLORS.black:False, COLORS.white:False,
+            'turns': {
+                COLORS.black:[], COLORS.white:[],
+            }
+        },
+        COLORS.black: {
+            COLORS.black:False, COLORS.white:False,
+            'turns': {
+                COLORS.black:[], COLORS.white:[],
+            }
+        }
+    }
 
 
-    output = {COLORS.black:False, COLORS.white:False}
-    for group in groups:
-        if checkGroupForRoad(board.size, group):
-            output[group.color] = True
+def addRoadTurn(output, moveColor, roadWins, move):
+    if roadWins[COLORS.black]:
+        output[moveColor][COLORS.black] = True
+        output[moveColor]['turns'][COLORS.black].append(move)
+    if roadWins[COLORS.white]:
+        output[moveColor][COLORS.white] = True
+        output[moveColor]['turns'][COLORS.white].append(move)
 
-    # print(output)
-    return output
 
+def checkTak(game, table=None):
+    """Return object {white:True, black:False}
+    If a TakZobrist.TranspositionTable is given, results are stored by board hash
+    and positions already in the table are not analysed again. Cached results
+    are shared, callers should not modify them.
+    """
 
-def buildGroup(board, group, space):
+    if table is not None:
+        cached = table.lookup(game.board.hash)
+        if cached is not None:
+            return cached
 
-    # print("Enter build group - {}({}) - group: {}".format(
-    #     space,
-    #     board.grid[space[0]][space[1]].color,
-    #     group['color'])
-    # )
+    output = findThreats(game)
 
-    if space not in group.stones and board.grid[space[0]][space[1]].color == group.color and board.grid[space[0]][space[1]].stones[-1].piece != PIECES.wall:
+    if table is not None:
+        table.store(game.board.hash, output)
 
-        group.stones.append(space)
+    return output
 
-        neighbours = getNeighbours(board.size, space)
 
-        # print("Added to group. Will test Neighbours: {}".format(neighbours) )
+def scanTak(game):
+    """Reference version of checkTak: applies every legal move of both players
+    and checks the roads after each one.
+    """
+    output = newTakResult()
 
-        for neighbour in neighbours:
-            buildGroup(board, group, neighbour)
+    for moveColor in [COLORS.white, COLORS.black]:
+        # Moves are streamed, explored in place and undone, no board copies
+        for code in gameMoves(game, moveColor):
+            move = toTurn(code)
+            record = game.board.apply(move)
+            roadWins = checkRoads(game.board)
+            game.board.undo(record)
 
+            addRoadTurn(output, moveColor, roadWins, move)
 
-def getNeighbours(size, space):
-    x = space[0]
-    y = space[1]
+    return output
 
-    output = []
 
-    if x < size-1:
-        output.append( (x+1,y) )
+# ====================================================
+#                   Threat Detection
+# Only moves that can complete a road are looked at.
+#
+# A road made by a move has to use a square the move
+# gave to that color, so it runs through the moved
+# stack's path. Placements are decided from the edges
+# touched by the neighbouring road groups. Stack moves
+# are first bounded by the edges reachable from their
+# path, only the moves passing that bound are applied
+# and checked.
+# ====================================================
 
-    if x > 0:
-        output.append( (x-1, y) )
+def findThreats(game):
+    """Same result as scanTak, from the road groups of the board's road tracker
+    """
+    board = game.board
+    tracker = getattr(board, 'roadTracker', None)
+
+    # Positions already holding a road are rare (finished games), scan them
+    if tracker is None or tracker.hasRoad(COLORS.white) or tracker.hasRoad(COLORS.black):
+        return scanTak(game)
 
-    if y < size-1:
-        output.append( (x,y+1) )
+    output = newTakResult()
+    reach = roadReach(board)
+    firstTurn = len(game.turns) < 2
 
-    if y > 0:
-        output.append( (x, y-1) )
+    for moveColor in [COLORS.white, COLORS.black]:
+        player = game.players[moveColor]
+        moveThreats(board, reach, output, moveColor, player.flats, player.caps, firstTurn)
 
     return output
 
 
-def checkGroupForRoad(size, group):
-    horizontalMin = False
-    horizontalMax = False
-    verticalMin = False
-    verticalMax = False
+def roadReach(board):
+    """Edges a square would reach when owned by each color: its own edges and
+    those of the neighbouring groups of that color. Indexed by color value,
+    then by square.
+    """
+    tracker = board.roadTracker
+    edges = tracker.edges
+    neighbours = tracker.neighbours
+
+    reach = [None, None]
+    for color in COLORS:
+        value = color.value
+        flags = tracker.flags[value]
+        rootFlags = {}
+        reach[value] = colorReach = []
+        for index in range(board.size*board.size):
+            output = edges[index]
+            for neighbour in neighbours[index]:
+                if tracker.owner[neighbour] == color:
+                    if neighbour not in rootFlags:
+                        rootFlags[neighbour] = flags[tracker.find(value, neighbour)]
+                    output |= rootFlags[neighbour]
+            colorReach.append(output)
+
+    return reach
+
+
+def moveThreats(board, reach, output, moveColor, flats, caps, firstTurn):
+    """Adds the moves of moveColor that complete a road to a checkTak result.
+    flats and caps are the stones moveColor has left to place.
+    """
+    size = board.size
+    colors, pieces, heights = board.tops()
+    spaces = getSpaces(size)
+    drops = getDropTable(size)
+    mods = [(direction, getDirectionMods(direction)) for direction in DIRECTIONS]
+
+    # The first turn places the opponent's stone
+    placeColor = moveColor
+    if firstTurn:
+        placeColor = COLORS.black if moveColor == COLORS.white else COLORS.white
+    roadWins = {COLORS.white: placeColor == COLORS.white, COLORS.black: placeColor == COLORS.black}
+
+    index = 0
+    for x in range(size):
+        for y in range(size):
 
-    for stone in group.stones:
-        if stone[0] == 0:
-            horizontalMin = True
-        if stone[0] == size-1:
-            horizontalMax = True
+            # Placements, only flats and caps can complete a road
+            if not heights[index]:
+                if spans(reach[placeColor.value][index]):
+                    if flats > 0:
+                        addRoadTurn(output, moveColor, roadWins, Turn(placeColor, spaces[index], piece=PIECES.flat))
+                    if caps > 0 and not firstTurn:
+                        addRoadTurn(output, moveColor, roadWins, Turn(placeColor, spaces[index], piece=PIECES.cap))
 
-        if stone[1] == 0:
-            verticalMin = True
-        if stone[1] == size-1:
-            verticalMax = True
+            elif colors[index] == moveColor and not firstTurn:
+                stackThreats(board, output, moveColor, x, y, pieces, reach, drops, mods)
 
-    return (horizontalMin and horizontalMax) or (verticalMin and verticalMax)
+            index += 1
+
+
+def stackThreats(board, output, moveColor, x, y, pieces, reach, drops, mods):
+    """Adds the stack moves from x, y that complete a road, in generateMoves order
+    """
+    size = board.size
+    stack = board.grid[x][y]
+    height = stack.count
+    carry = min(size, height)
+    isCap = stack.top == PIECES.cap
+
+    # Colors (as values, the stack bits) that can end up on top of the origin and of the squares dropped on
+    originColors = set()
+    for picks in range(1, carry+1):
+        if picks < height:
+            originColors.add(stack.bits >> (height-picks-1) & 1)
+    dropColors = set(stack.bits >> n & 1 for n in range(height-carry, height))
+
+    # Bound per direction and distance: edges each color could reach through the path
+    origin = x*size + y
+    bounds = {}
+    for direction, (xmod, ymod) in mods:
+        flags = [reach[value][origin] if value in originColors else 0 for value in (0, 1)]
+        passes = [False]
+        for distance in range(1, carry+1):
+            xcheck = x+xmod*distance
+            ycheck = y+ymod*distance
+            if xcheck < 0 or xcheck >= size or ycheck < 0 or ycheck >= size:
+                break
+            for value in dropColors:
+                flags[value] |= reach[value][xcheck*size + ycheck]
+            passes.append(spans(flags[0]) or spans(flags[1]))
+        bounds[direction] = passes
+
+    for picks in range(1, carry+1):
+        for direction, (xmod, ymod) in mods:
+            passes = bounds[direction]
+            for moveSpaces in range(1, picks+1):
+                if moveSpaces >= len(passes):
+                    # reached an off board square
+                    break
+
+                piece = pieces[(x+xmod*moveSpaces)*size + y+ymod*moveSpaces]
+                if piece == PIECES.cap:
+                    break
+
+                elif piece == PIECES.wall:
+                    if isCap and passes[moveSpaces]:
+                        checkStackMoves(board, output, moveColor, x, y, direction, drops.flattens[picks][moveSpaces])
+                    break
+
+                elif passes[moveSpaces]:
+                    checkStackMoves(board, output, moveColor, x, y, direction, drops.sequences[picks][moveSpaces])
+
+
+def checkStackMoves(board, output, moveColor, x, y, direction, sequences):
+    space = getSpaces(board.size)[x*board.size + y]
+    for sequence in sequences:
+        move = Turn(moveColor, space, isMove=True, direction=direction, drops=sequence)
+        record = board.apply(move)
+        roadWins = checkRoads(board)
+        board.undo(record)
+
+        addRoadTurn(output, moveColor, roadWins, move)
+
+
+def winningMoves(board, color, flats, caps, firstTurn=False):
+    """Returns the moves (TakMoves codes) of color that complete a road for
+    color, winning on the spot. flats and caps are the stones color has left.
+    """
+    # No road can be built from the first two stones
+    if firstTurn:
+        return []
+
+    tracker = getattr(board, 'roadTracker', None)
+    if tracker is None or tracker.hasRoad(COLORS.white) or tracker.hasRoad(COLORS.black):
+        output = []
+        for code in generateMoves(board, color, flats, caps):
+            record = board.apply(toTurn(code))
+            roadWins = checkRoads(board)
+            board.undo(record)
+            if roadWins[color]:
+                output.append(code)
+        return output
+
+    output = newTakResult()
+    moveThreats(board, roadReach(board), output, color, flats, caps, False)
+    return [fromTurn(turn) for turn in output[color]['turns'][color]]
 
 
 # ====================================================
-#                     Count Flats
+#                     Block Tak
+# A defence has to change a square some threat needs:
+# the squares it moves through or places on, or a
+# road group it joins. Only moves touching every
+# threat are applied and checked for replies.
+#
+# Placements and stack moves that only cover squares
+# with the mover's own stones can't give the
+# opponent new threats, with no threats on the board
+# they are safe without a check.
 # ====================================================
 
-def countFlats(board):
-    #Returns object like: {white:5, black:7}
+def blockTak(game):
+    """Returns a list of Tak.Turn objects that will prevent Tak from occurring this turn
+    """
+    flats = {color: game.players[color].flats for color in COLORS}
+    caps  = {color: game.players[color].caps for color in COLORS}
+    return [toTurn(code) for code in blockMoves(game.board, len(game.turns), flats, caps)]
+
+
+def blockMoves(board, ply, flats, caps):
+    """blockTak for an explicit position: ply is the number of turns played,
+    flats and caps the stones each color has left. Returns TakMoves codes.
+    """
+    size = board.size
+    color = COLORS.white if ply % 2 == 0 else COLORS.black
+    other = COLORS.black if color == COLORS.white else COLORS.white
+    firstTurn = ply < 2
+
+    # First turns place the opponent's stone
+    stoneColor = other if firstTurn else color
 
-    output = {COLORS.white:0, COLORS.black:0}
-    for row in board.grid:
-        for stack in row:
-            if stack.color and stack.stones[-1].piece == PIECES.flat:
-                output[stack.color] += 1
+    wins = set(winningMoves(board, color, flats[color], caps[color], firstTurn))
+    threats = winningMoves(board, other, flats[other], caps[other], firstTurn)
+
+    # Boards without a road tracker (BitBoard) have every move applied and checked
+    supports = None
+    if getattr(board, 'roadTracker', None) is not None:
+        supports = [threatSupport(board, code, other) for code in threats]
+
+    output = []
+    for code in generateMoves(board, stoneColor, flats[stoneColor], caps[stoneColor], firstTurn):
+        # Completing a road ends the game, the opponent gets no reply
+        if code in wins:
+            output.append(code)
+            continue
+
+        if supports is not None:
+            changed = moveSquares(code, size)
+            if not all(support & changed for support in supports):
+                continue
+
+            # First turn placements give the opponent a stone, they are always checked
+            if not supports and stoneColor == color and keepsThreats(board, code):
+                output.append(code)
+                continue
+
+        if not replyWins(board, code, color, other, flats, caps, ply):
+            output.append(code)
 
-    print("countFlats output - {}".format(output) )
     return output
 
-# ====================================================
-#                     Check for Tak
-# Tak is checked for both players having next move,
-# The response object has a key for each color with
-# the TAK status based on that color moving next.
-#
-# The method also returns a list of the moves which
-#  would complete a road win.
-# ====================================================
 
-def checkTak(game):
-    """Return object {white:True, black:False}
+def moveSquares(code, size):
+    """Indexes of the squares a move places on, picks from or drops on
     """
+    row = moveRow(code)
+    fil = moveFil(code)
+    squares = {row*size + fil}
+    if isStackMove(code):
+        rowMod, filMod = getDirectionMods(moveDirection(code))
+        for drop in moveDrops(code):
+            row += rowMod
+            fil += filMod
+            squares.add(row*size + fil)
+    return squares
+
+
+def threatSupport(board, code, color):
+    """Squares a road threat of color depends on: the squares the move changes and
+    the road groups of color next to them
+    """
+    size = board.size
+    tracker = board.roadTracker
+    value = color.value
+
+    changed = moveSquares(code, size)
+    roots = set()
+    for index in changed:
+        for neighbour in tracker.neighbours[index]:
+            if tracker.owner[neighbour] == color:
+                roots.add(tracker.find(value, neighbour))
+
+    support = set(changed)
+    if roots:
+        for index in range(size*size):
+            if tracker.owner[index] == color and tracker.find(value, index) in roots:
+                support.add(index)
+    return support
+
+
+def keepsThreats(board, code):
+    """True when a move can't create road threats for the opponent: it only
+    places one of the mover's stones, or moves a flat topped stack carrying
+    only the mover's stones and leaving one of them on top of the origin.
+    Such a stack can't lift a wall or cap the opponent would have to stop at,
+    nor drop onto one.
+    """
+    if not isStackMove(code):
+        return True
 
-    output = {
-        COLORS.white: {
-            COLORS.black:False, COLORS.white:False,
-            'turns': {
-                COLORS.black:[], COLORS.white:[],
-            }
-        },
-        COLORS.black: {
-            COLORS.black:False, COLORS.white:False,
-            'turns': {
-                COLORS.black:[], COLORS.white:[],
-            }
-        }
-    }
+    stack = board.grid[moveRow(code)][moveFil(code)]
+    picks = sum(moveDrops(code))
+    height = stack.count
+
+    if picks >= height or stack.top != PIECES.flat:
+        return False
+
+    # The carried stones and the one left on top all have the top color
+    mask = (1 << (picks+1)) - 1
+    bits = stack.bits >> (height-picks-1) & mask
+    return bits == (mask if stack.color == COLORS.black else 0)
 
-    for moveColor in [COLORS.white, COLORS.black]:
-        allMoves = getAllMoves(game, moveColor)
 
-        # 2.
-        for move in allMoves:
-            testBoard = copy.deepcopy(game.board)
-            testBoard.apply(move)
+def replyWins(board, code, color, other, flats, caps, ply):
+    """Plays a move of color and checks if other can then complete a road
+    """
+    turn = toTurn(code)
+    record = board.apply(turn)
+
+    roadWins = checkRoads(board)
+    if roadWins[color] or roadWins[other]:
+        # A move completing both roads wins for the mover
+        output = not roadWins[color]
+    else:
+        otherFlats = flats[other]
+        otherCaps = caps[other]
+        if not turn.isMove and turn.color == other:
+            if turn.piece == PIECES.cap:
+                otherCaps -= 1
+            else:
+                otherFlats -= 1
 
-            roadWins = checkRoads(testBoard)
-            if roadWins[COLORS.black]:
-                output[moveColor][COLORS.black] = True
-                output[moveColor]['turns'][COLORS.black].append(move)
-            if roadWins[COLORS.white]:
-                output[moveColor][COLORS.white] = True
-                output[moveColor]['turns'][COLORS.white].append(move)
+        firstTurn = ply+1 < 2
+        if getattr(board, 'roadTracker', None) is None:
+            output = scanReplies(board, other, otherFlats, otherCaps, firstTurn)
+        else:
+            replies = newTakResult()
+            moveThreats(board, roadReach(board), replies, other, otherFlats, otherCaps, firstTurn)
+            output = replies[other][other]
 
+    board.undo(record)
     return output
 
 
-def blockTak(game):
-    """Returns a list of Tak.Turn objects that will prevent Tak from occurring this turn
+def scanReplies(board, other, flats, caps, firstTurn):
+    """Checks every move of other for a road, for boards without a road tracker
     """
-    return []
+    # No road can be built from the first two stones
+    if firstTurn:
+        return False
+
+    for code in generateMoves(board, other, flats, caps):
+        record = board.apply(toTurn(code))
+        roadWins = checkRoads(board)
+        board.undo(record)
+        if roadWins[other]:
+            return True
+    return False
+
 
 def getAllMoves(game, setColor=None):
     """For a given game state, return a list of all tak moves that are possible
@@ -196,117 +480,15 @@ def getAllMoves(game, setColor=None):
         color = setColor
 
     else:
-        if (len(game.turns)/2) % 1 == 0:
-            color = COLORS.white
-        else:
-            color = COLORS.black
+        color = game.turnColor()
 
-        if firstTurn:
-            if color == COLORS.black:
-                color = COLORS.white
-            else:
-                color = COLORS.black
-
-        if oppositeColor:
-            if color == COLORS.black:
-                color = COLORS.white
-            else:
-                color = COLORS.black
-
-    for x in range(game.size):
-        for y in range(game.size):
-            space = Space(x, y)
-            stack = board.getStack(space)
-
-            # Placements
-            if not stack.stones:
-                if game.players[color].flats > 0:
-                    #  Flats
-                    turn = Turn(color, Space(x, y))
-                    turns.append(turn)
-                    #  Walls
-                    if not firstTurn:
-                        turn = Turn(color, Space(x, y), piece=PIECES.wall)
-                        turns.append(turn)
-                if game.players[color].caps > 0 and not firstTurn:
-                    #  Caps
-                    turn = Turn(color, Space(x, y), piece=PIECES.cap)
-                    turns.append(turn)
-
-
-            # Moves
-            #  stack move permutations from max drop to min (shortest move to longest)
-            elif stack.color == color and not firstTurn:
-                available = len(stack.stones)
-                for picks in range(1,min(game.size, available)+1):
-                    for direction in DIRECTIONS:
-                        xmod, ymod = getDirectionMods(direction)
-                        for moveSpaces in range(1,picks+1):
-                            xcheck = x+xmod*moveSpaces
-                            ycheck = y+ymod*moveSpaces
-
-
-                            finalSpace = Space(xcheck, ycheck)
-                            finalStack = board.getStack(finalSpace)
-
-                            if not finalStack:
-                                #reached an off board square, move to next direction
-                                break
-
-                            elif finalStack.stones and finalStack.stones[-1].piece == PIECES.cap:
-                                # can't stack onto a cap
-                                break
-
-                            elif finalStack.stones and finalStack.stones[-1].piece == PIECES.wall and stack.stones[-1].piece == PIECES.cap:
-                                # write moves for flattening a wall
-                                if moveSpaces == 1:
-                                    if picks == 1:
-                                        turn = Turn(color, Space(x,y), isMove=True, direction=direction, drops=[picks])
-                                        turns.append(turn)
-                                    else:
-                                        #can't move more than just the cap onto a wall
-                                        break
-                                else:
-                                    dropSequences = dropPermutations(picks-1, moveSpaces-1, permutations=[], drops=[])
-                                    for sequence in dropSequences:
-                                        sequence.append(1)
-                                        turn = Turn(color, Space(x,y), isMove=True, direction=direction, drops=sequence)
-                                        turns.append(turn)
-
-                                break
-
-                            else:
-                                dropSequences = dropPermutations(picks, moveSpaces, permutations=[], drops=[])
-                                for sequence in dropSequences:
-                                    turn = Turn(color, Space(x,y), isMove=True, direction=direction, drops=sequence)
-                                    turns.append(turn)
+    player = game.players[color]
+    for move in generateMoves(board, color, player.flats, player.caps, firstTurn):
+        turns.append(toTurn(move))
 
     return turns
 
 
-def dropPermutations(stones, spaces, permutations=[], drops=[]):
-    """Given a stack of a set number of stones, with a limited number of spaces
-    available to move, this function returns a list of lists, where each sublist
-    is a potential sequence of number of stones dropped at each space.
-    """
-    if stones+len(drops) < spaces:
-        return permutations
-
-    # Final call
-    if len(drops) == spaces-1:
-        drops.append(stones)
-        permutations.append(drops)
-        return permutations
-    else:
-        for drop in range(1, stones-spaces+len(drops) + 2 ):
-            nextDrops = list(drops)
-            nextDrops.append(drop)
-            nextStones = stones-drop
-            permutations = dropPermutations(nextStones, spaces, permutations=permutations, drops=nextDrops)
-
-    return permutations
-
-
 def main():
     print(dropPermutations(2,1))
     print(dropPermutations(4,2))
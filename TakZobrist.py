@@ -0,0 +1,191 @@
+import random
+from enum import Enum
+
+"""
+TakZobrist
+
+Zobrist hashing of Tak positions and a bounded transposition table.
+
+Every stone at every height of every square has a random 64 bit key, plus one
+key for the side to move. A position hash is the XOR of the keys of the stones
+on the board, so Board.apply and Board.undo can keep it up to date by XORing
+only the stones that moved. Keys are generated from a fixed seed so hashes are
+stable between runs and processes.
+"""
+
+SEED = 0x7a6b
+
+# Stone kinds are indexed by color.value * 3 + piece.value
+KINDS = 6
+
+
+class Keys(object):
+    """Zobrist keys for one board size
+    """
+
+    def __init__(self, size):
+        self.size = size
+
+        # Every stone of both players fits in one stack for all standard sizes
+        self.maxHeight = 3*size*size
+
+        rand = random.Random(SEED + size)
+        self.stones = [rand.getrandbits(64) for n in range(size*size * self.maxHeight * KINDS)]
+        self.side = rand.getrandbits(64)
+
+    def stone(self, index, height, color, piece):
+        """Key of a stone at a square index and height
+        """
+        return self.stones[(index*self.maxHeight + height)*KINDS + color.value*3 + piece.value]
+
+    def run(self, index, height, bits, num, piece):
+        """XOR of the keys of num stones from height up, packed as in Tak.Stack
+        (bit n set for black). The top stone is piece, the others are flats.
+        """
+        stones = self.stones
+        position = (index*self.maxHeight + height)*KINDS
+        output = 0
+        for n in range(num-1):
+            output ^= stones[position + (bits >> n & 1)*3]
+            position += KINDS
+        return output ^ stones[position + (bits >> (num-1) & 1)*3 + piece.value]
+
+    # Keys are shared per size, copies and pickles refer back to the shared table
+    def __reduce__(self):
+        return (getKeys, (self.size,))
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+_KEYS = {}
+
+def getKeys(size):
+    """Returns the shared Keys for a board size, built on first use
+    """
+    if size not in _KEYS:
+        _KEYS[size] = Keys(size)
+    return _KEYS[size]
+
+
+def hashBoard(board):
+    """Computes the hash of a Tak.Board from scratch, white to move.
+    Boards keep their own hash incrementally, this is for boards built by hand.
+    """
+    keys = getKeys(board.size)
+    output = 0
+    for row in range(board.size):
+        for fil in range(board.size):
+            index = row*board.size + fil
+            for height, stone in enumerate(board.grid[row][fil].stones):
+                output ^= keys.stone(index, height, stone.color, stone.piece)
+    return output
+
+
+# ====================================================
+#                Transposition Table
+# ====================================================
+
+class REPLACEMENT(Enum):
+    '''Policy deciding which entry keeps a transposition table slot
+    '''
+    always  = 0     # newest entry wins
+    depth   = 1     # deepest entry wins, ties go to the newest
+    twoTier = 2     # each slot holds one depth preferred and one always replaced entry
+
+
+class TranspositionTable(object):
+    """Fixed size table of position results keyed by Zobrist hash.
+    Capacity is the number of entries kept, lookups and stores are O(1).
+    """
+
+    def __init__(self, capacity=1 << 16, policy=REPLACEMENT.always):
+        self.policy = policy
+
+        # two tier tables split capacity into pairs of entries
+        if policy == REPLACEMENT.twoTier:
+            self.slots = max(1, capacity // 2)
+            self.capacity = self.slots * 2
+        else:
+            self.slots = max(1, capacity)
+            self.capacity = self.slots
+
+        self.keys   = [None] * self.capacity
+        self.values = [None] * self.capacity
+        self.depths = [0] * self.capacity
+
+        self.hits   = 0
+        self.misses = 0
+        self.stores = 0
+
+    def index(self, key):
+        if self.policy == REPLACEMENT.twoTier:
+            return (key % self.slots) * 2
+        return key % self.slots
+
+    def lookup(self, key):
+        """Returns the stored value for key, None if absent
+        """
+        index = self.index(key)
+        if self.keys[index] == key:
+            self.hits += 1
+            return self.values[index]
+
+        if self.policy == REPLACEMENT.twoTier and self.keys[index+1] == key:
+            self.hits += 1
+            return self.values[index+1]
+
+        self.misses += 1
+        return None
+
+    def lookupDepth(self, key):
+        """Returns (value, depth) for key, (None, 0) if absent
+        """
+        index = self.index(key)
+        if self.policy == REPLACEMENT.twoTier and self.keys[index] != key:
+            index += 1
+
+        if self.keys[index] == key:
+            self.hits += 1
+            return self.values[index], self.depths[index]
+
+        self.misses += 1
+        return None, 0
+
+    def store(self, key, value, depth=0):
+        index = self.index(key)
+
+        if self.policy == REPLACEMENT.depth:
+            if self.keys[index] is not None and self.keys[index] != key and self.depths[index] > depth:
+                return
+
+        elif self.policy == REPLACEMENT.twoTier:
+            # First entry of the pair is depth preferred, second is always replaced
+            if self.keys[index] == key or self.keys[index] is None or self.depths[index] <= depth:
+                if self.keys[index] != key and self.keys[index] is not None:
+                    # demote the old deep entry to the always replaced slot
+                    self.keys[index+1] = self.keys[index]
+                    self.values[index+1] = self.values[index]
+                    self.depths[index+1] = self.depths[index]
+            else:
+                index += 1
+
+        self.keys[index] = key
+        self.values[index] = value
+        self.depths[index] = depth
+        self.stores += 1
+
+    def clear(self):
+        for index in range(self.capacity):
+            self.keys[index] = None
+            self.values[index] = None
+            self.depths[index] = 0
+
+    def __contains__(self, key):
+        index = self.index(key)
+        if self.keys[index] == key:
+            return True
+        return self.policy == REPLACEMENT.twoTier and self.keys[index+1] == key
+
+    def __len__(self):
+        return sum(1 for key in self.keys if key is not None)